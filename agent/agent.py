@@ -13,6 +13,9 @@ from proxy.proxy import add_route, remove_route, load_routes
 
 BACKEND_URL = os.environ.get("BACKEND_URL", "http://localhost:8000")
 
+# Shared HTTP client for backend callbacks, created on startup
+HTTP_CLIENT = None
+
 app = FastAPI()
 
 # Track running processes mapping app_id -> {"proc": process, "type": "docker"/"docker_tar"/"docker_compose"/"gradio"}
@@ -82,6 +85,21 @@ async def _cleanup_deleted_app(app_id: str):
     remove_route(app_id)
 
 
+@app.on_event("startup")
+async def open_http_client():
+    """Create the shared client used for backend callbacks and readiness probes."""
+    global HTTP_CLIENT
+    HTTP_CLIENT = httpx.AsyncClient(
+        timeout=5, limits=httpx.Limits(max_keepalive_connections=32)
+    )
+
+
+@app.on_event("shutdown")
+async def close_http_client():
+    if HTTP_CLIENT is not None:
+        await HTTP_CLIENT.aclose()
+
+
 @app.on_event("startup")
 async def recover_running_apps():
     """Detect running apps and restart heartbeat loops."""
@@ -90,11 +108,10 @@ async def recover_running_apps():
     # Query backend for app statuses to get GPU assignments if available
     status_map = {}
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(f"{BACKEND_URL}/status", timeout=5)
-            resp.raise_for_status()
-            for info in resp.json():
-                status_map[info.get("id")] = info
+        resp = await HTTP_CLIENT.get(f"{BACKEND_URL}/status", timeout=5)
+        resp.raise_for_status()
+        for info in resp.json():
+            status_map[info.get("id")] = info
     except Exception:
         pass
 
@@ -140,12 +157,11 @@ async def recover_running_apps():
                 usage = {idx: vram_required for idx in gpus}
                 reserve_gpus(usage)
             try:
-                async with httpx.AsyncClient() as client:
-                    await client.post(
-                        f"{BACKEND_URL}/update_status",
-                        json={"app_id": app_id, "status": "running", "gpus": gpus},
-                        timeout=5,
-                    )
+                await HTTP_CLIENT.post(
+                    f"{BACKEND_URL}/update_status",
+                    json={"app_id": app_id, "status": "running", "gpus": gpus},
+                    timeout=5,
+                )
             except Exception:
                 pass
             asyncio.create_task(heartbeat_loop(app_id))
@@ -304,16 +320,18 @@ async def async_run_detached(cmd, log_path, env=None, cwd=None):
 @app.post("/run")
 async def run_app(req: RunRequest, background_tasks: BackgroundTasks):
     # configure the proxy for the assigned port and start build/run in background
-    add_route(req.app_id, req.port, req.allow_ips, req.auth_header)
+    try:
+        add_route(req.app_id, req.port, req.allow_ips, req.auth_header)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     result = get_available_gpu(req.vram_required)
     if result is None:
         try:
-            async with httpx.AsyncClient() as client:
-                await client.post(
-                    f"{BACKEND_URL}/update_status",
-                    json={"app_id": req.app_id, "status": "error", "gpus": None},
-                    timeout=5,
-                )
+            await HTTP_CLIENT.post(
+                f"{BACKEND_URL}/update_status",
+                json={"app_id": req.app_id, "status": "error", "gpus": None},
+                timeout=5,
+            )
         except Exception:
             pass
         remove_route(req.app_id)
@@ -322,12 +340,11 @@ async def run_app(req: RunRequest, background_tasks: BackgroundTasks):
     gpus, usage = result
 
     try:
-        async with httpx.AsyncClient() as client:
-            await client.post(
-                f"{BACKEND_URL}/update_status",
-                json={"app_id": req.app_id, "status": "building", "gpus": gpus},
-                timeout=5,
-            )
+        await HTTP_CLIENT.post(
+            f"{BACKEND_URL}/update_status",
+            json={"app_id": req.app_id, "status": "building", "gpus": gpus},
+            timeout=5,
+        )
     except Exception:
         pass
     req.gpus = gpus  # type: ignore
@@ -347,16 +364,18 @@ async def run_app(req: RunRequest, background_tasks: BackgroundTasks):
 async def restart_app(req: RunRequest, background_tasks: BackgroundTasks):
     """Restart an app using an existing Docker image."""
     req.reuse_image = True
-    add_route(req.app_id, req.port, req.allow_ips, req.auth_header)
+    try:
+        add_route(req.app_id, req.port, req.allow_ips, req.auth_header)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     result = get_available_gpu(req.vram_required)
     if result is None:
         try:
-            async with httpx.AsyncClient() as client:
-                await client.post(
-                    f"{BACKEND_URL}/update_status",
-                    json={"app_id": req.app_id, "status": "error", "gpus": None},
-                    timeout=5,
-                )
+            await HTTP_CLIENT.post(
+                f"{BACKEND_URL}/update_status",
+                json={"app_id": req.app_id, "status": "error", "gpus": None},
+                timeout=5,
+            )
         except Exception:
             pass
         remove_route(req.app_id)
@@ -365,12 +384,11 @@ async def restart_app(req: RunRequest, background_tasks: BackgroundTasks):
     gpus, usage = result
 
     try:
-        async with httpx.AsyncClient() as client:
-            await client.post(
-                f"{BACKEND_URL}/update_status",
-                json={"app_id": req.app_id, "status": "building", "gpus": gpus},
-                timeout=5,
-            )
+        await HTTP_CLIENT.post(
+            f"{BACKEND_URL}/update_status",
+            json={"app_id": req.app_id, "status": "building", "gpus": gpus},
+            timeout=5,
+        )
     except Exception:
         pass
     req.gpus = gpus  # type: ignore
@@ -391,19 +409,18 @@ async def wait_for_http_ready(app_id: str, port: int, proc):
     url = f"http://127.0.0.1:{port}/"
     while proc.returncode is None:
         try:
-            async with httpx.AsyncClient() as client:
-                await client.get(url, timeout=1)
-                entry = PROCESSES.get(app_id)
-                gpus = entry.get("gpus") if entry else None
-                resp = await client.post(
-                    f"{BACKEND_URL}/update_status",
-                    json={"app_id": app_id, "status": "running", "gpus": gpus},
-                    timeout=5,
-                )
-                if resp.status_code == 404:
-                    await _cleanup_deleted_app(app_id)
-                    return
+            await HTTP_CLIENT.get(url, timeout=1)
+            entry = PROCESSES.get(app_id)
+            gpus = entry.get("gpus") if entry else None
+            resp = await HTTP_CLIENT.post(
+                f"{BACKEND_URL}/update_status",
+                json={"app_id": app_id, "status": "running", "gpus": gpus},
+                timeout=5,
+            )
+            if resp.status_code == 404:
+                await _cleanup_deleted_app(app_id)
                 return
+            return
         except Exception:
             await asyncio.sleep(1)
 
@@ -417,12 +434,11 @@ async def build_and_run(req: RunRequest):
         result = get_available_gpu(req.vram_required)
         if result is None:
             try:
-                async with httpx.AsyncClient() as client:
-                    await client.post(
-                        f"{BACKEND_URL}/update_status",
-                        json={"app_id": req.app_id, "status": "error", "gpus": None},
-                        timeout=5,
-                    )
+                await HTTP_CLIENT.post(
+                    f"{BACKEND_URL}/update_status",
+                    json={"app_id": req.app_id, "status": "error", "gpus": None},
+                    timeout=5,
+                )
             finally:
                 remove_route(req.app_id)
                 release_process_entry(req.app_id)
@@ -431,12 +447,11 @@ async def build_and_run(req: RunRequest):
 
     if not is_port_free(req.port):
         try:
-            async with httpx.AsyncClient() as client:
-                await client.post(
-                    f"{BACKEND_URL}/update_status",
-                    json={"app_id": req.app_id, "status": "error", "gpus": None},
-                    timeout=5,
-                )
+            await HTTP_CLIENT.post(
+                f"{BACKEND_URL}/update_status",
+                json={"app_id": req.app_id, "status": "error", "gpus": None},
+                timeout=5,
+            )
         finally:
             remove_route(req.app_id)
             release_process_entry(req.app_id)
@@ -461,12 +476,11 @@ async def build_and_run(req: RunRequest):
             ret = await async_run_wait(build_cmd, req.log_path)
             if ret != 0:
                 try:
-                    async with httpx.AsyncClient() as client:
-                        await client.post(
-                            f"{BACKEND_URL}/update_status",
-                            json={"app_id": req.app_id, "status": "error"},
-                            timeout=5,
-                        )
+                    await HTTP_CLIENT.post(
+                        f"{BACKEND_URL}/update_status",
+                        json={"app_id": req.app_id, "status": "error"},
+                        timeout=5,
+                    )
                 finally:
                     remove_route(req.app_id)
                     release_process_entry(req.app_id)
@@ -503,12 +517,11 @@ async def build_and_run(req: RunRequest):
             compose_file = os.path.join(req.path, "docker-compose.yaml")
         if not os.path.exists(compose_file):
             try:
-                async with httpx.AsyncClient() as client:
-                    await client.post(
-                        f"{BACKEND_URL}/update_status",
-                        json={"app_id": req.app_id, "status": "error"},
-                        timeout=5,
-                    )
+                await HTTP_CLIENT.post(
+                    f"{BACKEND_URL}/update_status",
+                    json={"app_id": req.app_id, "status": "error"},
+                    timeout=5,
+                )
             finally:
                 remove_route(req.app_id)
                 release_process_entry(req.app_id)
@@ -527,12 +540,11 @@ async def build_and_run(req: RunRequest):
         ret = await async_run_wait(cmd, req.log_path, env=env)
         if ret != 0:
             try:
-                async with httpx.AsyncClient() as client:
-                    await client.post(
-                        f"{BACKEND_URL}/update_status",
-                        json={"app_id": req.app_id, "status": "error"},
-                        timeout=5,
-                    )
+                await HTTP_CLIENT.post(
+                    f"{BACKEND_URL}/update_status",
+                    json={"app_id": req.app_id, "status": "error"},
+                    timeout=5,
+                )
             finally:
                 remove_route(req.app_id)
             release_process_entry(req.app_id)
@@ -563,12 +575,11 @@ async def build_and_run(req: RunRequest):
             ret = await async_run_wait(load_cmd, req.log_path)
             if ret != 0:
                 try:
-                    async with httpx.AsyncClient() as client:
-                        await client.post(
-                            f"{BACKEND_URL}/update_status",
-                            json={"app_id": req.app_id, "status": "error"},
-                            timeout=5,
-                        )
+                    await HTTP_CLIENT.post(
+                        f"{BACKEND_URL}/update_status",
+                        json={"app_id": req.app_id, "status": "error"},
+                        timeout=5,
+                    )
                 finally:
                     remove_route(req.app_id)
                     release_process_entry(req.app_id)
@@ -610,12 +621,11 @@ async def build_and_run(req: RunRequest):
             target = py_files[0] if py_files else None
         if not target:
             try:
-                async with httpx.AsyncClient() as client:
-                    await client.post(
-                        f"{BACKEND_URL}/update_status",
-                        json={"app_id": req.app_id, "status": "error"},
-                        timeout=5,
-                    )
+                await HTTP_CLIENT.post(
+                    f"{BACKEND_URL}/update_status",
+                    json={"app_id": req.app_id, "status": "error"},
+                    timeout=5,
+                )
             finally:
                 remove_route(req.app_id)
                 release_process_entry(req.app_id)
@@ -631,12 +641,11 @@ async def build_and_run(req: RunRequest):
         )
         if ret != 0:
             try:
-                async with httpx.AsyncClient() as client:
-                    await client.post(
-                        f"{BACKEND_URL}/update_status",
-                        json={"app_id": req.app_id, "status": "error"},
-                        timeout=5,
-                    )
+                await HTTP_CLIENT.post(
+                    f"{BACKEND_URL}/update_status",
+                    json={"app_id": req.app_id, "status": "error"},
+                    timeout=5,
+                )
             finally:
                 remove_route(req.app_id)
                 release_process_entry(req.app_id)
@@ -654,12 +663,11 @@ async def build_and_run(req: RunRequest):
             )
             if ret != 0:
                 try:
-                    async with httpx.AsyncClient() as client:
-                        await client.post(
-                            f"{BACKEND_URL}/update_status",
-                            json={"app_id": req.app_id, "status": "error"},
-                            timeout=5,
-                        )
+                    await HTTP_CLIENT.post(
+                        f"{BACKEND_URL}/update_status",
+                        json={"app_id": req.app_id, "status": "error"},
+                        timeout=5,
+                    )
                 finally:
                     remove_route(req.app_id)
                     release_process_entry(req.app_id)
@@ -694,12 +702,11 @@ async def wait_for_port(app_id: str, port: int, proc):
             s.settimeout(1)
             if s.connect_ex(("127.0.0.1", port)) == 0:
                 try:
-                    async with httpx.AsyncClient() as client:
-                        await client.post(
-                            f"{BACKEND_URL}/update_status",
-                            json={"app_id": app_id, "status": "running"},
-                            timeout=5,
-                        )
+                    await HTTP_CLIENT.post(
+                        f"{BACKEND_URL}/update_status",
+                        json={"app_id": app_id, "status": "running"},
+                        timeout=5,
+                    )
                 except Exception:
                     pass
                 return
@@ -715,15 +722,14 @@ async def wait_for_compose_ready(app_id: str, port: int):
             s.settimeout(1)
             if s.connect_ex(("127.0.0.1", port)) == 0:
                 try:
-                    async with httpx.AsyncClient() as client:
-                        resp = await client.post(
-                            f"{BACKEND_URL}/update_status",
-                            json={"app_id": app_id, "status": "running"},
-                            timeout=5,
-                        )
-                        if resp.status_code == 404:
-                            await _cleanup_deleted_app(app_id)
-                            return
+                    resp = await HTTP_CLIENT.post(
+                        f"{BACKEND_URL}/update_status",
+                        json={"app_id": app_id, "status": "running"},
+                        timeout=5,
+                    )
+                    if resp.status_code == 404:
+                        await _cleanup_deleted_app(app_id)
+                        return
                 except Exception:
                     pass
                 return
@@ -804,15 +810,14 @@ async def heartbeat_loop(app_id: str):
 
         if not running:
             try:
-                async with httpx.AsyncClient() as client:
-                    resp = await client.post(
-                        f"{BACKEND_URL}/update_status",
-                        json={"app_id": app_id, "status": status, "gpus": None},
-                        timeout=5,
-                    )
-                    if resp.status_code == 404:
-                        await _cleanup_deleted_app(app_id)
-                        break
+                resp = await HTTP_CLIENT.post(
+                    f"{BACKEND_URL}/update_status",
+                    json={"app_id": app_id, "status": status, "gpus": None},
+                    timeout=5,
+                )
+                if resp.status_code == 404:
+                    await _cleanup_deleted_app(app_id)
+                    break
             except Exception:
                 pass
             remove_route(app_id)
@@ -820,15 +825,14 @@ async def heartbeat_loop(app_id: str):
             break
 
         try:
-            async with httpx.AsyncClient() as client:
-                resp = await client.post(
-                    f"{BACKEND_URL}/heartbeat",
-                    json={"app_id": app_id},
-                    timeout=5,
-                )
-                if resp.status_code == 404:
-                    await _cleanup_deleted_app(app_id)
-                    break
+            resp = await HTTP_CLIENT.post(
+                f"{BACKEND_URL}/heartbeat",
+                json={"app_id": app_id},
+                timeout=5,
+            )
+            if resp.status_code == 404:
+                await _cleanup_deleted_app(app_id)
+                break
         except Exception:
             pass
 
@@ -868,12 +872,11 @@ async def stop_app(req: StopRequest):
     remove_route(req.app_id)
 
     try:
-        async with httpx.AsyncClient() as client:
-            await client.post(
-                f"{BACKEND_URL}/update_status",
-                json={"app_id": req.app_id, "status": "stopped", "gpus": None},
-                timeout=5,
-            )
+        await HTTP_CLIENT.post(
+            f"{BACKEND_URL}/update_status",
+            json={"app_id": req.app_id, "status": "stopped", "gpus": None},
+            timeout=5,
+        )
     except Exception:
         pass
 
@@ -883,7 +886,8 @@ async def stop_app(req: StopRequest):
 @app.post("/remove_route")
 async def remove_route_endpoint(req: RemoveRouteRequest):
     """Remove an app's proxy route regardless of process state."""
-    remove_route(req.app_id)
+    if not remove_route(req.app_id):
+        return {"detail": "no route"}
     return {"detail": "removed"}
 
 
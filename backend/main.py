@@ -8,13 +8,15 @@ from fastapi import (
     Form,
     BackgroundTasks,
     Depends,
+    Request,
     status,
 )
-from fastapi.responses import PlainTextResponse, FileResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
 import shutil
+import io
 import os
 import subprocess
 import stat
@@ -22,29 +24,79 @@ import uuid
 import zipfile
 import sqlite3
 import httpx
-import re
 import time
 import asyncio
+import collections
 import socket
 import threading
+import glob
+import gzip
+import heapq
+import itertools
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
+import orjson
 from passlib.context import CryptContext
 
-DATABASE = "./app.db"
-UPLOAD_DIR = "./uploads"
-LOG_DIR = "./logs"
-TEMPLATE_DIR = "./templates"
+DATABASE = os.environ.get("DATABASE_PATH", "./app.db")
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", "./uploads")
+LOG_DIR = os.environ.get("LOG_DIR", "./logs")
+TEMPLATE_DIR = os.environ.get("TEMPLATE_DIR", "./templates")
+# New templates are assembled here and moved into TEMPLATE_DIR once their row
+# exists, so ensure_templates() never registers a half-written one
+TEMPLATE_STAGING_DIR = os.path.join(TEMPLATE_DIR, ".staging")
+# Deleted app directories are moved here and removed in the background
+TRASH_DIR = os.path.join(UPLOAD_DIR, ".trash")
 AGENT_URL = os.environ.get("AGENT_URL", "http://localhost:8001")
 AGENT_TIMEOUT = int(os.environ.get("AGENT_TIMEOUT", 30))
+# Unix socket of a colocated agent; bypasses loopback TCP when set
+AGENT_SOCK = os.environ.get("AGENT_SOCK")
 
 # Port range to allocate for running apps
 PORT_START = int(os.environ.get("PORT_START", 9000))
 PORT_END = int(os.environ.get("PORT_END", 9100))
-AVAILABLE_PORTS = set(range(PORT_START, PORT_END))
-PORT_LOCK = threading.Lock()
+# One bit per port in the range, set while the port is assigned to an app;
+# only touched from the event loop
+PORT_BITMAP = bytearray((PORT_END - PORT_START + 7) // 8)
+# Index where the next free-port search starts, so freed ports are reused last
+PORT_CURSOR = 0
 TEMPLATE_DEPLOY_LOCK = asyncio.Lock()
+# Shared database connection opened by init_db(); DB_LOCK serializes its use
+DB = None
+DB_LOCK = threading.Lock()
+# Writes queued for writer_task(), which commits them in batches
+WRITE_Q: asyncio.Queue | None = None
+# Shared HTTP client for agent requests, created on startup
+AGENT_CLIENT = None
+# Latest heartbeat per app waiting to be written to the database
+PENDING_HB: dict[str, float] = {}
+# Running apps are marked as errored after this long without a heartbeat
+HEARTBEAT_TIMEOUT = 60
+# Heartbeat deadline of every tracked app, plus a min-heap with one
+# (deadline, app_id) entry per app in HB_QUEUED. Heap entries may lag behind
+# HB_DEADLINE; cleanup_task re-queues them when they surface.
+HB_DEADLINE: dict[str, float] = {}
+HB_HEAP: list[tuple[float, str]] = []
+HB_QUEUED: set[str] = set()
+# Wakes cleanup_task when an app is tracked while the heap is empty
+HB_WAKE: asyncio.Event | None = None
+# Worker threads for blocking file and database work (asyncio.to_thread)
+IO_WORKERS = 64
+HEARTBEAT_FLUSH_INTERVAL = float(os.environ.get("HEARTBEAT_FLUSH_INTERVAL", 5))
+# Serialized /status body; dropped by a database trigger whenever a row it
+# shows changes (see _status_changed)
+STATUS_CACHE: bytes | None = None
+# Set (and replaced) on every such change to wake /status/stream clients
+STATUS_CHANGED = asyncio.Event()
+# Serialized /templates body and its gzip form, dropped on template changes
+TEMPLATES_CACHE: tuple[bytes, bytes] | None = None
+# Part size for chunked uploads (/upload/init)
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+# Chunked uploads with no activity for this many seconds are discarded
+UPLOAD_EXPIRY = 24 * 3600
 app = FastAPI()
 
 
@@ -61,6 +113,225 @@ def force_rmtree(path: str):
     if os.path.exists(path) and os.name != "nt":
         subprocess.run(["rm", "-rf", path], check=False)
 
+
+async def purge_path(path: str):
+    """Remove a directory tree in a worker thread."""
+    await asyncio.to_thread(force_rmtree, path)
+
+
+def _move_to_trash(path: str, name: str) -> str | None:
+    """Move ``path`` into TRASH_DIR so it can be purged later.
+
+    Returns the path to purge: the trash entry, ``path`` itself if it could
+    not be moved, or None if it does not exist.
+    """
+    trash = os.path.join(TRASH_DIR, f"{name}.{uuid.uuid4().hex}")
+    try:
+        os.rename(path, trash)
+    except FileNotFoundError:
+        return None
+    except OSError:
+        return path
+    return trash
+
+
+def _link_or_copy(src: str, dst: str):
+    """copytree() copy function that hardlinks Docker image tarballs.
+
+    Image archives are only ever read, so sharing the inode is safe and
+    avoids copying gigabytes; everything else is copied as it may be edited
+    in place by the app.
+    """
+    if src.endswith(".tar"):
+        try:
+            os.link(src, dst)
+            return dst
+        except OSError:
+            pass  # e.g. different filesystem
+    return shutil.copy2(src, dst)
+
+
+def copy_tree(src: str, dst: str):
+    """Copy an app or template directory (blocking; use a worker thread)."""
+    shutil.copytree(src, dst, copy_function=_link_or_copy)
+
+
+def copy_upload(src, dest: str):
+    """Copy an uploaded file object to ``dest``.
+
+    When the upload is backed by a file descriptor the bytes are copied inside
+    the kernel with ``copy_file_range``; otherwise (or if the kernel refuses)
+    a buffered userspace copy with 1 MiB chunks is used.
+    """
+    with open(dest, "wb") as f:
+        offset = src.tell()
+        try:
+            src_fd = src.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            src_fd = None  # e.g. an in-memory file
+        if src_fd is not None and hasattr(os, "copy_file_range"):
+            try:
+                while True:
+                    n = os.copy_file_range(src_fd, f.fileno(), 1 << 30, offset_src=offset)
+                    if n == 0:
+                        return
+                    offset += n
+            except (OSError, ValueError):
+                # e.g. EXDEV/ENOSYS; finish the copy from where the kernel stopped
+                src.seek(offset)
+        shutil.copyfileobj(src, f, length=1 << 20)
+
+
+
+async def save_stream(chunks, dest: str, limit: int | None = None):
+    """Write an async iterator of byte chunks to ``dest``.
+
+    Chunks are gathered into 1 MiB batches and written from a worker thread,
+    so the event loop never blocks on disk and memory stays bounded. A body
+    longer than ``limit`` bytes is rejected with 413 and ``dest`` removed.
+    Returns the number of bytes written.
+    """
+    f = await asyncio.to_thread(open, dest, "wb")
+    try:
+        buf = bytearray()
+        total = 0
+        async for chunk in chunks:
+            total += len(chunk)
+            if limit is not None and total > limit:
+                await asyncio.to_thread(f.close)
+                await asyncio.to_thread(os.remove, dest)
+                raise HTTPException(status_code=413, detail="chunk too large")
+            buf += chunk
+            if len(buf) >= 1 << 20:
+                await asyncio.to_thread(f.write, buf)
+                buf = bytearray()
+        if buf:
+            await asyncio.to_thread(f.write, buf)
+    finally:
+        await asyncio.to_thread(f.close)
+    return total
+
+
+def join_parts(parts, dest: str):
+    """Concatenate the files in ``parts`` into ``dest``, in order."""
+    with open(dest, "wb") as f:
+        for part in parts:
+            with open(part, "rb") as src:
+                offset = 0
+                try:
+                    while True:
+                        n = os.sendfile(f.fileno(), src.fileno(), offset, 1 << 30)
+                        if n == 0:
+                            break
+                        offset += n
+                except OSError:
+                    src.seek(offset)
+                    shutil.copyfileobj(src, f, length=1 << 20)
+
+
+# Files marking an app as a Docker or docker compose project
+_COMPOSE_NAMES = frozenset({"docker-compose.yml", "docker-compose.yaml"})
+_DOCKERFILE_NAMES = frozenset({"dockerfile"})
+_APP_MARKERS = _COMPOSE_NAMES | _DOCKERFILE_NAMES
+
+
+def detect_app_type(root: str):
+    """Return ``(app_type, marker_path)`` for the project in ``root``.
+
+    Only the top two directory levels are searched, stopping at the first
+    Dockerfile or compose file, so large trees are not walked completely.
+    """
+    for path in itertools.chain(
+        glob.iglob(os.path.join(root, "*")), glob.iglob(os.path.join(root, "*", "*"))
+    ):
+        if os.path.basename(path).lower() in _APP_MARKERS and os.path.isfile(path):
+            return _app_type_for_marker(path)
+    return "gradio", None
+
+
+def _app_type_for_marker(marker: str | None):
+    if marker is None:
+        return "gradio", None
+    if os.path.basename(marker).lower() in _DOCKERFILE_NAMES:
+        return "docker", marker
+    return "docker_compose", marker
+
+
+def find_file(root: str, match) -> str | None:
+    """Return the path of the first file under ``root`` whose lowercased name
+    satisfies ``match``.
+
+    Directories are searched level by level, so a top-level hit returns
+    without descending, and ``os.scandir`` entries answer the file/dir
+    checks without extra ``stat`` calls.
+    """
+    pending = collections.deque([root])
+    while pending:
+        subdirs = []
+        with os.scandir(pending.popleft()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                elif entry.is_file(follow_symlinks=False) and match(entry.name.lower()):
+                    return entry.path
+        pending.extend(subdirs)
+    return None
+
+
+def extract_zip(z: zipfile.ZipFile, dest: str, label: str = "app"):
+    """Extract ``z`` into ``dest`` in one pass, checking each entry first.
+
+    Entries that would land outside ``dest`` are rejected. Returns
+    ``(app_type, marker_path)`` like :func:`detect_app_type` would for the
+    extracted tree, computed from the archive listing along the way.
+    """
+    base = os.path.realpath(dest)
+    prefix = base + os.sep
+    # First marker file found at depth one and depth two
+    markers = [None, None]
+    for info in z.infolist():
+        member = info.filename
+        # Reject absolute paths or traversals
+        if os.path.isabs(member) or ".." in member.split("/"):
+            raise HTTPException(status_code=400, detail="invalid zip entry path")
+        target = os.path.normpath(os.path.join(base, member))
+        if target.startswith(prefix) and not info.is_dir():
+            parts = target[len(prefix) :].split(os.sep)
+            depth = len(parts) - 1
+            if (
+                depth < 2
+                and markers[depth] is None
+                and parts[-1].lower() in _APP_MARKERS
+                # glob (used by detect_app_type) skips hidden entries
+                and not any(p.startswith(".") for p in parts)
+            ):
+                markers[depth] = os.path.join(dest, *parts)
+        # No realpath() per entry: dest is fresh and ZipFile.extract writes
+        # symlink entries as regular files, so no link can redirect a member
+        if target != base and not target.startswith(prefix):
+            raise HTTPException(
+                status_code=400, detail=f"zip entry outside {label} directory"
+            )
+        z.extract(info, dest)
+    return _app_type_for_marker(markers[0] or markers[1])
+
+
+def _extract_and_detect(file_location: str, dest: str, label: str = "app"):
+    """Unpack an uploaded zip into ``dest`` and detect the app type.
+
+    Returns ``(app_type, marker_path)``; ``.tar`` uploads are Docker images.
+    Blocking, so handlers run it in a worker thread.
+    """
+    detected = None
+    if zipfile.is_zipfile(file_location):
+        with zipfile.ZipFile(file_location, "r") as z:
+            detected = extract_zip(z, dest, label)
+    if file_location.lower().endswith(".tar"):
+        return "docker_tar", None
+    # For archives the listing already told us
+    return detected or detect_app_type(dest)
+
+
 # Authentication setup
 SECRET_KEY = os.environ.get("SECRET_KEY", "change_me")
 ALGORITHM = "HS256"
@@ -81,7 +352,18 @@ async def frontend_index():
 
 
 # Allowed pattern for uploaded filenames
-ALLOWED_FILENAME = re.compile(r"^[A-Za-z0-9._-]+$")
+# Filenames may only contain ASCII letters, digits and "._-"
+_FILENAME_PUNCT = "._-"
+_STRIP_FILENAME_PUNCT = str.maketrans("", "", _FILENAME_PUNCT)
+
+
+def is_allowed_filename(filename: str) -> bool:
+    """Return True if ``filename`` is non-empty and uses only allowed characters."""
+    if not filename or not filename.isascii():
+        return False
+    rest = filename.translate(_STRIP_FILENAME_PUNCT)
+    # An all-punctuation name leaves nothing behind, which isalnum() rejects
+    return rest.isalnum() or not rest
 
 
 def get_password_hash(password: str) -> str:
@@ -101,15 +383,108 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None) -> s
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
+@contextlib.contextmanager
+def db_transaction():
+    """Hold the database lock and run the block in a single transaction."""
+    with DB_LOCK:
+        DB.execute("BEGIN")
+        try:
+            yield DB
+        except BaseException:
+            DB.execute("ROLLBACK")
+            raise
+        DB.execute("COMMIT")
+
+
+def db_fetchone(sql: str, params=()):
+    """Run a query on the shared connection and return its first row."""
+    with DB_LOCK:
+        return DB.execute(sql, params).fetchone()
+
+
+def db_executemany(sql: str, seq):
+    """Run a write statement for every parameter set in one transaction."""
+    with db_transaction() as db:
+        db.executemany(sql, seq)
+
+
+async def db_write(sql: str, params=(), many: bool = False):
+    """Queue a write for the writer task and wait until it is committed.
+
+    Returns the rows produced by the statement (for ``RETURNING`` clauses).
+    Before the writer has started the statement runs directly. Every write
+    after startup goes through here; only init_db() writes directly.
+    """
+    if WRITE_Q is None:
+        if many:
+            db_executemany(sql, params)
+            return []
+        with DB_LOCK:
+            return DB.execute(sql, params).fetchall()
+    fut = asyncio.get_running_loop().create_future()
+    await WRITE_Q.put((sql, params, many, fut))
+    return await fut
+
+
+def _apply_writes(batch):
+    """Run queued writes in one transaction; return a result per write.
+
+    Each write gets its own savepoint, so a failing one is undone entirely
+    (including earlier rows of an executemany) while the rest still commit.
+    If the transaction itself fails it is rolled back, leaving the
+    connection usable for the next batch.
+    """
+    results = []
+    with DB_LOCK:
+        DB.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, params, many, _ in batch:
+                DB.execute("SAVEPOINT write")
+                try:
+                    if many:
+                        DB.executemany(sql, params)
+                        result = []
+                    else:
+                        result = DB.execute(sql, params).fetchall()
+                except sqlite3.Error as e:
+                    DB.execute("ROLLBACK TO write")
+                    result = e
+                DB.execute("RELEASE write")
+                results.append(result)
+            DB.execute("COMMIT")
+        except BaseException:
+            if DB.in_transaction:
+                DB.execute("ROLLBACK")
+            raise
+    return results
+
+
+async def writer_task():
+    """Single database writer; drains WRITE_Q and commits each batch at once."""
+    while True:
+        batch = [await WRITE_Q.get()]
+        while not WRITE_Q.empty():
+            batch.append(WRITE_Q.get_nowait())
+        try:
+            results = _apply_writes(batch)
+        except Exception as e:
+            # Fail the whole batch but keep the writer alive, so no caller
+            # is left waiting forever
+            results = [e] * len(batch)
+        for (*_, fut), result in zip(batch, results):
+            if fut.done():
+                continue
+            if isinstance(result, Exception):
+                fut.set_exception(result)
+            else:
+                fut.set_result(result)
+
+
 def get_user(username: str):
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute(
+    row = db_fetchone(
         "SELECT id, username, password_hash, is_admin FROM users WHERE username=?",
         (username,),
     )
-    row = c.fetchone()
-    conn.close()
     if row:
         return {
             "id": row[0],
@@ -148,158 +523,256 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     return user
 
 
+def _status_changed():
+    """Drop the cached /status payload and wake stream subscribers."""
+    global STATUS_CACHE, STATUS_CHANGED
+    STATUS_CACHE = None
+    changed, STATUS_CHANGED = STATUS_CHANGED, asyncio.Event()
+    changed.set()
+
+
+def _templates_changed():
+    """Drop the cached /templates payload."""
+    global TEMPLATES_CACHE
+    TEMPLATES_CACHE = None
+
+
+def _set_bit(blob: bytes, i: int) -> bytes:
+    """SQL function ``set_bit(blob, i)``: ``blob`` with bit ``i`` set."""
+    bits = bytearray(blob)
+    bits[i >> 3] |= 1 << (i & 7)
+    return bytes(bits)
+
+
 def init_db():
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute(
-        """
-        CREATE TABLE IF NOT EXISTS apps (
-            id TEXT PRIMARY KEY,
-            name TEXT,
-            description TEXT,
-            type TEXT,
-            status TEXT,
-            log_path TEXT,
-            port INTEGER,
-            last_heartbeat REAL,
-            url TEXT,
-            allow_ips TEXT,
-            auth_header TEXT,
-            gpus TEXT,
-            vram_required INTEGER
-        )
-        """
+    global DB
+    DB = sqlite3.connect(
+        DATABASE, check_same_thread=False, isolation_level=None, cached_statements=512
     )
-    c.execute(
-        """
-        CREATE TABLE IF NOT EXISTS templates (
-            id TEXT PRIMARY KEY,
-            name TEXT,
-            type TEXT,
-            path TEXT,
-            description TEXT,
-            vram_required INTEGER
+    # WAL lets readers proceed while a write is in progress
+    DB.execute("PRAGMA journal_mode=WAL")
+    DB.execute("PRAGMA synchronous=NORMAL")
+    DB.execute("PRAGMA temp_store=MEMORY")
+    DB.execute("PRAGMA cache_size=-64000")
+    # Read pages straight from the page cache instead of copying them in
+    DB.execute("PRAGMA mmap_size=268435456")
+    # Schema and migrations commit together, with a single sync
+    with db_transaction():
+        c = DB.cursor()
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS apps (
+                id TEXT PRIMARY KEY,
+                name TEXT,
+                description TEXT,
+                type TEXT,
+                status TEXT,
+                log_path TEXT,
+                port INTEGER,
+                last_heartbeat REAL,
+                url TEXT,
+                allow_ips TEXT,
+                auth_header TEXT,
+                gpus TEXT,
+                vram_required INTEGER
+            )
+            """
         )
-        """
-    )
-    c.execute(
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE,
-            password_hash TEXT,
-            is_admin INTEGER DEFAULT 0
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS templates (
+                id TEXT PRIMARY KEY,
+                name TEXT,
+                type TEXT,
+                path TEXT,
+                description TEXT,
+                vram_required INTEGER
+            )
+            """
         )
-        """
-    )
-    # Add new columns if database existed before
-    c.execute("PRAGMA table_info(apps)")
-    cols = [row[1] for row in c.fetchall()]
-    if "port" not in cols:
-        c.execute("ALTER TABLE apps ADD COLUMN port INTEGER")
-    if "last_heartbeat" not in cols:
-        c.execute("ALTER TABLE apps ADD COLUMN last_heartbeat REAL")
-    if "url" not in cols:
-        c.execute("ALTER TABLE apps ADD COLUMN url TEXT")
-    if "allow_ips" not in cols:
-        c.execute("ALTER TABLE apps ADD COLUMN allow_ips TEXT")
-    if "auth_header" not in cols:
-        c.execute("ALTER TABLE apps ADD COLUMN auth_header TEXT")
-    if "gpus" not in cols:
-        c.execute("ALTER TABLE apps ADD COLUMN gpus TEXT")
-    if "vram_required" not in cols:
-        c.execute("ALTER TABLE apps ADD COLUMN vram_required INTEGER")
-    if "description" not in cols:
-        c.execute("ALTER TABLE apps ADD COLUMN description TEXT")
-    # Add new columns to users table if needed
-    c.execute("PRAGMA table_info(users)")
-    u_cols = [row[1] for row in c.fetchall()]
-    if "is_admin" not in u_cols:
-        c.execute("ALTER TABLE users ADD COLUMN is_admin INTEGER DEFAULT 0")
-
-    # Add new columns to templates table if needed
-    c.execute("PRAGMA table_info(templates)")
-    t_cols = [row[1] for row in c.fetchall()]
-    if "vram_required" not in t_cols:
-        c.execute("ALTER TABLE templates ADD COLUMN vram_required INTEGER")
-    conn.commit()
-    conn.close()
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE,
+                password_hash TEXT,
+                is_admin INTEGER DEFAULT 0
+            )
+            """
+        )
+        # Chunked uploads in progress; chunks is a bitmap of received parts
+        c.execute(
+            """
+            CREATE TABLE IF NOT EXISTS uploads (
+                id TEXT PRIMARY KEY,
+                filename TEXT,
+                size INTEGER,
+                chunks BLOB,
+                name TEXT,
+                description TEXT,
+                allow_ips TEXT,
+                auth_header TEXT,
+                vram_required INTEGER,
+                updated REAL,
+                claimed INTEGER DEFAULT 0
+            )
+            """
+        )
+        # Add new columns if database existed before
+        c.execute("PRAGMA table_info(apps)")
+        cols = [row[1] for row in c.fetchall()]
+        if "port" not in cols:
+            c.execute("ALTER TABLE apps ADD COLUMN port INTEGER")
+        if "last_heartbeat" not in cols:
+            c.execute("ALTER TABLE apps ADD COLUMN last_heartbeat REAL")
+        if "url" not in cols:
+            c.execute("ALTER TABLE apps ADD COLUMN url TEXT")
+        if "allow_ips" not in cols:
+            c.execute("ALTER TABLE apps ADD COLUMN allow_ips TEXT")
+        if "auth_header" not in cols:
+            c.execute("ALTER TABLE apps ADD COLUMN auth_header TEXT")
+        if "gpus" not in cols:
+            c.execute("ALTER TABLE apps ADD COLUMN gpus TEXT")
+        if "vram_required" not in cols:
+            c.execute("ALTER TABLE apps ADD COLUMN vram_required INTEGER")
+        if "description" not in cols:
+            c.execute("ALTER TABLE apps ADD COLUMN description TEXT")
+        # Add new columns to users table if needed
+        c.execute("PRAGMA table_info(users)")
+        u_cols = [row[1] for row in c.fetchall()]
+        if "is_admin" not in u_cols:
+            c.execute("ALTER TABLE users ADD COLUMN is_admin INTEGER DEFAULT 0")
+
+        # Add new columns to templates table if needed
+        c.execute("PRAGMA table_info(templates)")
+        t_cols = [row[1] for row in c.fetchall()]
+        if "vram_required" not in t_cols:
+            c.execute("ALTER TABLE templates ADD COLUMN vram_required INTEGER")
+
+        c.execute("PRAGMA table_info(uploads)")
+        up_cols = [row[1] for row in c.fetchall()]
+        if "updated" not in up_cols:
+            c.execute("ALTER TABLE uploads ADD COLUMN updated REAL")
+        if "claimed" not in up_cols:
+            c.execute("ALTER TABLE uploads ADD COLUMN claimed INTEGER DEFAULT 0")
+
+        # App names are unique; older databases may hold duplicates, so keep the
+        # first of each and suffix the others before adding the index
+        c.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name='idx_apps_name'")
+        if not c.fetchone():
+            c.execute(
+                "UPDATE apps SET name = name || '-' || substr(id, 1, 8)"
+                " WHERE rowid NOT IN (SELECT MIN(rowid) FROM apps GROUP BY name)"
+            )
+            c.execute("CREATE UNIQUE INDEX idx_apps_name ON apps(name)")
+        # Stale apps are found by id (cleanup_task) and heartbeats live in
+        # app_heartbeat, so this index only slowed down writes to apps
+        c.execute("DROP INDEX IF EXISTS idx_apps_status_hb")
+        # Heartbeats are kept apart from the app rows (apps.last_heartbeat is no
+        # longer written); seed the table from that column on first use
+        c.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='app_heartbeat'")
+        if not c.fetchone():
+            c.execute(
+                "CREATE TABLE app_heartbeat (id TEXT PRIMARY KEY, ts REAL) WITHOUT ROWID"
+            )
+            c.execute(
+                "INSERT INTO app_heartbeat(id, ts)"
+                " SELECT id, last_heartbeat FROM apps WHERE last_heartbeat IS NOT NULL"
+            )
+    # Temp triggers live on this connection only and call back into Python,
+    # so every write that changes what /status or /templates shows
+    # invalidates the cached response
+    DB.create_function("status_changed", 0, _status_changed)
+    DB.create_function("templates_changed", 0, _templates_changed)
+    DB.create_function("set_bit", 2, _set_bit, deterministic=True)
+    for table, func, update in (
+        ("apps", "status_changed", "UPDATE OF name, description, status, url, gpus"),
+        ("templates", "templates_changed", "UPDATE"),
+    ):
+        for event in ("INSERT", "DELETE", update):
+            DB.execute(
+                f"CREATE TEMP TRIGGER IF NOT EXISTS {table}_{event.split()[0].lower()}"
+                f" AFTER {event} ON {table} BEGIN SELECT {func}(); END"
+            )
     os.makedirs(UPLOAD_DIR, exist_ok=True)
     os.makedirs(LOG_DIR, exist_ok=True)
     os.makedirs(TEMPLATE_DIR, exist_ok=True)
+    os.makedirs(TEMPLATE_STAGING_DIR, exist_ok=True)
+    os.makedirs(TRASH_DIR, exist_ok=True)
 
     # Ensure admin user exists
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
     c.execute("SELECT id FROM users WHERE username='admin'")
     if not c.fetchone():
         c.execute(
             "INSERT INTO users(username, password_hash, is_admin) VALUES(?, ?, 1)",
             ("admin", get_password_hash(ADMIN_PASSWORD)),
         )
-        conn.commit()
-    conn.close()
 
 
 init_db()
 
 
-def ensure_templates():
-    """Scan TEMPLATE_DIR for folders and register them as templates."""
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute("SELECT id FROM templates")
-    known = {row[0] for row in c.fetchall()}
+# st_mtime_ns of TEMPLATE_DIR at the last ensure_templates() scan
+TEMPLATE_SCAN_MTIME = None
+
+
+async def ensure_templates():
+    """Scan TEMPLATE_DIR for folders and register them as templates.
+
+    Adding, removing or renaming an entry bumps the directory's mtime, so the
+    scan is skipped while it is unchanged.
+    """
+    global TEMPLATE_SCAN_MTIME
+    mtime = os.stat(TEMPLATE_DIR).st_mtime_ns
+    if mtime == TEMPLATE_SCAN_MTIME:
+        return
+    with DB_LOCK:
+        known = {row[0] for row in DB.execute("SELECT id FROM templates")}
+    new_rows = []
     for entry in os.listdir(TEMPLATE_DIR):
         full = os.path.join(TEMPLATE_DIR, entry)
-        if not os.path.isdir(full) or entry in known:
+        # Dot entries are the staging area, not templates
+        if entry.startswith(".") or not os.path.isdir(full) or entry in known:
             continue
         app_type = "gradio"
         stored_path = "."
-        for root, _, files in os.walk(full):
-            for fname in files:
-                lower = fname.lower()
-                if lower.endswith(".tar"):
-                    app_type = "docker_tar"
-                    stored_path = fname
-                    break
-                if lower in ("docker-compose.yml", "docker-compose.yaml"):
-                    app_type = "docker_compose"
-                    stored_path = os.path.relpath(os.path.join(root, fname), full)
-                    break
-                if lower == "dockerfile":
-                    app_type = "docker"
-                    break
-            if app_type != "gradio":
-                break
-        c.execute(
-            "INSERT INTO templates(id, name, type, path, description, vram_required) VALUES(?,?,?,?,?,?)",
-            (entry, entry, app_type, stored_path, "", 0),
+        found = find_file(full, lambda n: n.endswith(".tar") or n in _APP_MARKERS)
+        if found:
+            lower = os.path.basename(found).lower()
+            if lower.endswith(".tar"):
+                app_type = "docker_tar"
+                stored_path = os.path.basename(found)
+            elif lower in _COMPOSE_NAMES:
+                app_type = "docker_compose"
+                stored_path = os.path.relpath(found, full)
+            else:
+                app_type = "docker"
+        new_rows.append((entry, entry, app_type, stored_path, "", 0))
+    if new_rows:
+        await db_write(
+            "INSERT INTO templates(id, name, type, path, description, vram_required)"
+            " VALUES(?,?,?,?,?,?) ON CONFLICT(id) DO NOTHING",
+            new_rows,
+            many=True,
         )
-    conn.commit()
-    conn.close()
-
+    # The mtime from before listing, so entries added meanwhile cause a rescan
+    TEMPLATE_SCAN_MTIME = mtime
 
-ensure_templates()
 
 
-def release_app_port(app_id: str):
+async def release_app_port(app_id: str):
     """Return the port used by the app back to the pool."""
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute("SELECT port FROM apps WHERE id=?", (app_id,))
-    row = c.fetchone()
+    row = db_fetchone("SELECT port FROM apps WHERE id=?", (app_id,))
     if row and row[0] is not None:
-        with PORT_LOCK:
-            AVAILABLE_PORTS.add(row[0])
-        c.execute("UPDATE apps SET port=NULL WHERE id=?", (app_id,))
-        conn.commit()
-    conn.close()
+        await db_write("UPDATE apps SET port=NULL WHERE id=?", (app_id,))
+        release_port(row[0])
 
 
 def is_port_free(port: int) -> bool:
     """Check if a TCP port is available."""
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # Apps bind with SO_REUSEADDR too, so TIME_WAIT leftovers don't count
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     try:
         s.bind(("0.0.0.0", port))
         return True
@@ -309,20 +782,96 @@ def is_port_free(port: int) -> bool:
         s.close()
 
 
+_TCP_TIME_WAIT = "06"  # socket state code in /proc/net/tcp
+
+
+def _used_ports_snapshot() -> set[int] | None:
+    """Return the local TCP ports currently in use, or None if unknown.
+
+    Reads /proc/net/tcp{,6} once instead of probing each port with bind().
+    Sockets in TIME_WAIT are skipped, matching is_port_free().
+    """
+    used = set()
+    found = False
+    for path in ("/proc/net/tcp", "/proc/net/tcp6"):
+        try:
+            f = open(path)
+        except OSError:
+            continue
+        found = True
+        with f:
+            next(f, None)  # header
+            for line in f:
+                _, local, _, state, _ = line.split(None, 4)
+                if state != _TCP_TIME_WAIT:
+                    used.add(int(local[local.rindex(":") + 1 :], 16))
+    return used if found else None
+
+
+def take_ports(ports):
+    """Mark ports as assigned so allocate_port() skips them."""
+    for port in ports:
+        if PORT_START <= port < PORT_END:
+            i = port - PORT_START
+            PORT_BITMAP[i >> 3] |= 1 << (i & 7)
+
+
+def release_port(port: int):
+    """Return a port to the pool."""
+    if PORT_START <= port < PORT_END:
+        i = port - PORT_START
+        PORT_BITMAP[i >> 3] &= ~(1 << (i & 7)) & 0xFF
+
+
+def _next_free_port_index(start: int) -> int | None:
+    """Index of the first clear bit at or after ``start``, wrapping around."""
+    count = PORT_END - PORT_START
+    free = ~int.from_bytes(PORT_BITMAP, "little") & ((1 << count) - 1)
+    if not free:
+        return None
+    bits = (free >> start << start) or free
+    return (bits & -bits).bit_length() - 1
+
+
+async def allocate_port(preferred: int | None = None) -> int:
+    """Take a free port from the pool, reusing ``preferred`` when it is free."""
+    used = await asyncio.to_thread(_used_ports_snapshot)
+
+    async def is_free(port: int) -> bool:
+        if used is not None:
+            return port not in used
+        return await asyncio.get_running_loop().run_in_executor(
+            None, is_port_free, port
+        )
+
+    global PORT_CURSOR
+    if preferred and await is_free(preferred):
+        take_ports((preferred,))
+        return preferred
+    busy = set()
+    while (idx := _next_free_port_index(PORT_CURSOR)) is not None:
+        candidate = PORT_START + idx
+        if candidate in busy:
+            break  # wrapped around to a port already found busy
+        take_ports((candidate,))
+        PORT_CURSOR = idx + 1
+        if await is_free(candidate):
+            return candidate
+        # port was busy, leave it in the pool and keep looking
+        release_port(candidate)
+        busy.add(candidate)
+    raise HTTPException(status_code=503, detail="no available ports")
+
+
 @app.post("/register")
 async def register(username: str = Form(...), password: str = Form(...)):
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute("SELECT id FROM users WHERE username=?", (username,))
-    if c.fetchone():
-        conn.close()
+    password_hash = get_password_hash(password)
+    if not await db_write(
+        "INSERT INTO users(username, password_hash) VALUES(?, ?)"
+        " ON CONFLICT(username) DO NOTHING RETURNING id",
+        (username, password_hash),
+    ):
         raise HTTPException(status_code=400, detail="username already exists")
-    c.execute(
-        "INSERT INTO users(username, password_hash) VALUES(?, ?)",
-        (username, get_password_hash(password)),
-    )
-    conn.commit()
-    conn.close()
     return {"detail": "user created"}
 
 
@@ -356,34 +905,23 @@ async def get_me(current_user: dict = Depends(get_current_user)):
 async def list_users(current_user: dict = Depends(get_current_user)):
     if not current_user.get("is_admin"):
         raise HTTPException(status_code=403, detail="admin only")
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute("SELECT id, username, is_admin FROM users")
-    users = [
-        {"id": row[0], "username": row[1], "is_admin": bool(row[2])}
-        for row in c.fetchall()
+    with DB_LOCK:
+        rows = DB.execute("SELECT id, username, is_admin FROM users").fetchall()
+    return [
+        {"id": row[0], "username": row[1], "is_admin": bool(row[2])} for row in rows
     ]
-    conn.close()
-    return users
 
 
 @app.delete("/users/{user_id}")
 async def delete_user(user_id: int, current_user: dict = Depends(get_current_user)):
     if not current_user.get("is_admin"):
         raise HTTPException(status_code=403, detail="admin only")
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute("SELECT username FROM users WHERE id=?", (user_id,))
-    row = c.fetchone()
-    if not row:
-        conn.close()
+    if not await db_write(
+        "DELETE FROM users WHERE id=? AND username!='admin' RETURNING id", (user_id,)
+    ):
+        if db_fetchone("SELECT id FROM users WHERE id=?", (user_id,)):
+            raise HTTPException(status_code=400, detail="cannot delete admin user")
         raise HTTPException(status_code=404, detail="user not found")
-    if row[0] == "admin":
-        conn.close()
-        raise HTTPException(status_code=400, detail="cannot delete admin user")
-    c.execute("DELETE FROM users WHERE id=?", (user_id,))
-    conn.commit()
-    conn.close()
     return {"detail": "deleted"}
 
 
@@ -395,18 +933,12 @@ async def reset_password(
 ):
     if not current_user.get("is_admin"):
         raise HTTPException(status_code=403, detail="admin only")
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute("SELECT id FROM users WHERE id=?", (user_id,))
-    if not c.fetchone():
-        conn.close()
+    password_hash = get_password_hash(new_password)
+    if not await db_write(
+        "UPDATE users SET password_hash=? WHERE id=? RETURNING id",
+        (password_hash, user_id),
+    ):
         raise HTTPException(status_code=404, detail="user not found")
-    c.execute(
-        "UPDATE users SET password_hash=? WHERE id=?",
-        (get_password_hash(new_password), user_id),
-    )
-    conn.commit()
-    conn.close()
     return {"detail": "password reset"}
 
 
@@ -424,12 +956,83 @@ class StopRequest(BaseModel):
     app_id: str
 
 
-def save_status(
+# Fixed statements for the frequent single-purpose status writes
+_UPDATE_STATUS = "UPDATE apps SET status=? WHERE id=?"
+_UPDATE_STATUS_GPUS = "UPDATE apps SET status=?, gpus=COALESCE(?, gpus) WHERE id=?"
+# Failed launch; the caller has already returned the port to the pool
+_MARK_ERROR = "UPDATE apps SET status='error', port=NULL WHERE id=?"
+# Heartbeats live in their own narrow table so they do not rewrite app rows
+_UPDATE_HEARTBEAT = (
+    "INSERT INTO app_heartbeat(id, ts) VALUES(?, ?)"
+    " ON CONFLICT(id) DO UPDATE SET ts=excluded.ts"
+)
+# Insert a new app unless its name is taken (unique index on apps.name)
+_INSERT_APP = """
+INSERT INTO apps(id, name, description, type, status, log_path, port, url,
+                 allow_ips, auth_header, vram_required)
+VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(name) DO NOTHING RETURNING id
+"""
+# Insert a new app or update only the columns that were given (non-NULL)
+_SAVE_STATUS = """
+INSERT INTO apps(id, name, description, type, status, log_path, port, url,
+                 allow_ips, auth_header, gpus, vram_required)
+VALUES(:id, COALESCE(:name, :id), :description, COALESCE(:type, ''),
+       COALESCE(:status, ''), :log_path, :port, :url, :allow_ips,
+       :auth_header, :gpus, :vram_required)
+ON CONFLICT(id) DO UPDATE SET
+    name=COALESCE(:name, name),
+    description=COALESCE(:description, description),
+    type=COALESCE(:type, type),
+    status=COALESCE(:status, status),
+    log_path=COALESCE(:log_path, log_path),
+    port=COALESCE(:port, port),
+    url=COALESCE(:url, url),
+    allow_ips=COALESCE(:allow_ips, allow_ips),
+    auth_header=COALESCE(:auth_header, auth_header),
+    gpus=COALESCE(:gpus, gpus),
+    vram_required=COALESCE(:vram_required, vram_required)
+"""
+
+
+async def insert_app(
+    app_id: str,
+    name: str,
+    status: str,
+    log_path: str,
+    port: int,
+    url: str,
+    app_type: str,
+    description: str = None,
+    allow_ips: str = None,
+    auth_header: str = None,
+    vram_required: int = None,
+) -> bool:
+    """Insert a new app row; return False if the name is already in use."""
+    rows = await db_write(
+        _INSERT_APP,
+        (
+            app_id,
+            name,
+            description,
+            app_type,
+            status,
+            log_path,
+            port,
+            url,
+            allow_ips,
+            auth_header,
+            vram_required,
+        ),
+    )
+    return bool(rows)
+
+
+async def save_status(
     app_id: str,
     status: str = None,
     log_path: str = None,
     port: int = None,
-    heartbeat: float = None,
     name: str = None,
     description: str = None,
     url: str = None,
@@ -439,170 +1042,65 @@ def save_status(
     gpus: List[int] | None = None,
     vram_required: int = None,
 ):
-
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute("SELECT id FROM apps WHERE id=?", (app_id,))
-    exists = c.fetchone()
-    if exists:
-        fields = []
-        values = []
-        if status is not None:
-            fields.append("status=?")
-            values.append(status)
-        if log_path is not None:
-            fields.append("log_path=?")
-            values.append(log_path)
-        if port is not None:
-            fields.append("port=?")
-            values.append(port)
-        if heartbeat is not None:
-            fields.append("last_heartbeat=?")
-            values.append(heartbeat)
-        if name is not None:
-            fields.append("name=?")
-            values.append(name)
-        if description is not None:
-            fields.append("description=?")
-            values.append(description)
-        if url is not None:
-            fields.append("url=?")
-            values.append(url)
-        if app_type is not None:
-            fields.append("type=?")
-            values.append(app_type)
-        if allow_ips is not None:
-            fields.append("allow_ips=?")
-            values.append(allow_ips)
-        if auth_header is not None:
-            fields.append("auth_header=?")
-            values.append(auth_header)
-        if gpus is not None:
-            fields.append("gpus=?")
-            values.append(",".join(map(str, gpus)))
-        if vram_required is not None:
-            fields.append("vram_required=?")
-            values.append(vram_required)
-        if fields:
-            values.append(app_id)
-            c.execute(f"UPDATE apps SET {','.join(fields)} WHERE id=?", values)
-    else:
-        c.execute(
-            "INSERT INTO apps(id, name, description, type, status, log_path, port, last_heartbeat, url, allow_ips, auth_header, gpus, vram_required) VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?)",
-            (
-                app_id,
-                name or app_id,
-                description,
-                app_type or "",
-                status or "",
-                log_path,
-                port,
-                heartbeat,
-                url,
-                allow_ips,
-                auth_header,
-                ",".join(map(str, gpus)) if gpus is not None else None,
-                vram_required,
-            ),
-        )
-    conn.commit()
-    conn.close()
+    await db_write(
+        _SAVE_STATUS,
+        {
+            "id": app_id,
+            "status": status,
+            "log_path": log_path,
+            "port": port,
+            "name": name,
+            "description": description,
+            "url": url,
+            "type": app_type,
+            "allow_ips": allow_ips,
+            "auth_header": auth_header,
+            "gpus": ",".join(map(str, gpus)) if gpus is not None else None,
+            "vram_required": vram_required,
+        },
+    )
 
 
-@app.post("/upload")
-async def upload_app(
-    name: str = Form(...),
-    file: UploadFile = File(...),
-    description: str = Form(""),
-    allow_ips: str = Form(None),
-    auth_header: str = Form(None),
-    vram_required: int = Form(0),
-    current_user: dict = Depends(get_current_user),
+async def start_uploaded_app(
+    app_id: str,
+    app_dir: str,
+    file_location: str,
+    name: str,
+    description: str = "",
+    allow_ips: str = None,
+    auth_header: str = None,
+    vram_required: int = 0,
 ):
-    """Receive user uploaded app and trigger agent build/run."""
+    """Register a freshly stored upload and ask the agent to build/run it."""
     allowed = [ip.strip() for ip in allow_ips.split(",")] if allow_ips else None
     allowed_str = ",".join(allowed) if allowed else None
-    # Reject duplicate app names
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute("SELECT id FROM apps WHERE name=?", (name.strip(),))
-    if c.fetchone():
-        conn.close()
-        raise HTTPException(status_code=400, detail="app name already exists")
-    conn.close()
-    app_id = str(uuid.uuid4())
-    app_dir = os.path.join(UPLOAD_DIR, app_id)
-    os.makedirs(app_dir, exist_ok=True)
-    filename = os.path.basename(file.filename)
-    if not ALLOWED_FILENAME.fullmatch(filename):
-        raise HTTPException(status_code=400, detail="invalid filename")
-    file_location = os.path.join(app_dir, filename)
-    with open(file_location, "wb") as f:
-        shutil.copyfileobj(file.file, f)
-
-    # If zip file, extract safely
-    if zipfile.is_zipfile(file_location):
-        with zipfile.ZipFile(file_location, "r") as z:
-            for member in z.namelist():
-                # Reject absolute paths or traversals
-                if os.path.isabs(member) or ".." in member.split("/"):
-                    raise HTTPException(
-                        status_code=400, detail="invalid zip entry path"
-                    )
-                resolved = os.path.realpath(os.path.join(app_dir, member))
-                if not resolved.startswith(os.path.realpath(app_dir) + os.sep):
-                    raise HTTPException(
-                        status_code=400, detail="zip entry outside app directory"
-                    )
-            z.extractall(app_dir)
-
-    # Detect app type
-    compose_file = None
-    if filename.lower().endswith(".tar"):
-        app_type = "docker_tar"
-    else:
-        app_type = "gradio"
-        for root, _, files in os.walk(app_dir):
-            for fname in files:
-                lower = fname.lower()
-                if lower in ("docker-compose.yml", "docker-compose.yaml"):
-                    app_type = "docker_compose"
-                    compose_file = os.path.join(root, fname)
-                    break
-                if lower == "dockerfile":
-                    app_type = "docker"
-                    break
-            if app_type in ("docker", "docker_compose"):
-                break
+    # Extract zip files safely and detect the app type off the event loop
+    app_type, marker = await asyncio.to_thread(
+        _extract_and_detect, file_location, app_dir
+    )
+    compose_file = marker if app_type == "docker_compose" else None
 
     log_path = os.path.join(LOG_DIR, f"{app_id}.log")
     # Allocate a port for the app
-    with PORT_LOCK:
-        if not AVAILABLE_PORTS:
-            raise HTTPException(status_code=503, detail="no available ports")
-        port = None
-        while AVAILABLE_PORTS:
-            candidate = AVAILABLE_PORTS.pop()
-            if is_port_free(candidate):
-                port = candidate
-                break
-            # port was busy, keep looking
-        if port is None:
-            raise HTTPException(status_code=503, detail="no available ports")
+    port = await allocate_port()
     url = f"/apps/{app_id}/"
-    save_status(
+    # Saved as building right away; the agent reports progress from here
+    if not await insert_app(
         app_id,
-        "uploaded",
+        name.strip(),
+        "building",
         log_path,
-        port=port,
-        name=name.strip(),
+        port,
+        url,
+        app_type,
         description=description.strip() if description else None,
-        url=url,
-        app_type=app_type,
         allow_ips=allowed_str,
         auth_header=auth_header,
         vram_required=vram_required,
-    )
+    ):
+        release_port(port)
+        await purge_path(app_dir)
+        raise HTTPException(status_code=400, detail="app name already exists")
 
     # Path sent to the agent depends on app type
     if app_type == "docker_tar":
@@ -614,236 +1112,426 @@ async def upload_app(
 
     # Request agent to run
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(
-                f"{AGENT_URL}/run",
-                json={
-                    "app_id": app_id,
-                    "path": run_path,
-                    "type": app_type,
-                    "log_path": log_path,
-                    "port": port,
-                    "allow_ips": allowed,
-                    "auth_header": auth_header,
-                    "vram_required": vram_required,
-                },
-                timeout=AGENT_TIMEOUT,
-            )
-            resp.raise_for_status()
-        save_status(
-            app_id,
-            "building",
-            log_path,
-            description=description.strip() if description else None,
-            app_type=app_type,
-            allow_ips=allowed_str,
-            auth_header=auth_header,
-            vram_required=vram_required,
+        resp = await AGENT_CLIENT.post(
+            "/run",
+            json={
+                "app_id": app_id,
+                "path": run_path,
+                "type": app_type,
+                "log_path": log_path,
+                "port": port,
+                "allow_ips": allowed,
+                "auth_header": auth_header,
+                "vram_required": vram_required,
+            },
         )
+        resp.raise_for_status()
     except httpx.ConnectError:
-        with PORT_LOCK:
-            AVAILABLE_PORTS.add(port)
-        save_status(
-            app_id,
-            "error",
-            log_path,
-            app_type=app_type,
-            allow_ips=allowed_str,
-            auth_header=auth_header,
-            vram_required=vram_required,
-        )
+        release_port(port)
+        await db_write(_MARK_ERROR, (app_id,))
         raise HTTPException(
             status_code=502,
             detail="Unable to reach agent. Please ensure the agent is running and reachable.",
         )
     except httpx.TimeoutException:
-        with PORT_LOCK:
-            AVAILABLE_PORTS.add(port)
-        save_status(
-            app_id,
-            "error",
-            log_path,
-            app_type=app_type,
-            allow_ips=allowed_str,
-            auth_header=auth_header,
-            vram_required=vram_required,
-        )
+        release_port(port)
+        await db_write(_MARK_ERROR, (app_id,))
         raise HTTPException(
             status_code=504,
             detail="Agent request timed out. Please make sure the agent is running.",
         )
     except Exception as e:
-        with PORT_LOCK:
-            AVAILABLE_PORTS.add(port)
-        save_status(
-            app_id,
-            "error",
-            log_path,
-            app_type=app_type,
-            allow_ips=allowed_str,
-            auth_header=auth_header,
-            vram_required=vram_required,
-        )
+        release_port(port)
+        await db_write(_MARK_ERROR, (app_id,))
         raise HTTPException(status_code=500, detail=str(e))
 
     return {"app_id": app_id, "status": "building", "url": url}
 
 
-@app.post("/templates")
-async def upload_template(
+@app.post("/upload")
+async def upload_app(
     name: str = Form(...),
     file: UploadFile = File(...),
     description: str = Form(""),
+    allow_ips: str = Form(None),
+    auth_header: str = Form(None),
     vram_required: int = Form(0),
     current_user: dict = Depends(get_current_user),
 ):
-    """Upload a template archive or file."""
-    template_id = str(uuid.uuid4())
-    t_dir = os.path.join(TEMPLATE_DIR, template_id)
-    os.makedirs(t_dir, exist_ok=True)
+    """Receive user uploaded app and trigger agent build/run."""
+    app_id = str(uuid.uuid4())
+    app_dir = os.path.join(UPLOAD_DIR, app_id)
+    os.makedirs(app_dir, exist_ok=True)
     filename = os.path.basename(file.filename)
-    if not ALLOWED_FILENAME.fullmatch(filename):
+    if not is_allowed_filename(filename):
         raise HTTPException(status_code=400, detail="invalid filename")
-    file_location = os.path.join(t_dir, filename)
-    with open(file_location, "wb") as f:
-        shutil.copyfileobj(file.file, f)
+    file_location = os.path.join(app_dir, filename)
+    await asyncio.to_thread(copy_upload, file.file, file_location)
 
-    if zipfile.is_zipfile(file_location):
-        with zipfile.ZipFile(file_location, "r") as z:
-            for member in z.namelist():
-                if os.path.isabs(member) or ".." in member.split("/"):
-                    raise HTTPException(
-                        status_code=400, detail="invalid zip entry path"
-                    )
-                resolved = os.path.realpath(os.path.join(t_dir, member))
-                if not resolved.startswith(os.path.realpath(t_dir) + os.sep):
-                    raise HTTPException(
-                        status_code=400, detail="zip entry outside template directory"
-                    )
-            z.extractall(t_dir)
-
-    if filename.lower().endswith(".tar"):
-        app_type = "docker_tar"
-        stored_path = filename
-    else:
-        app_type = "gradio"
-        stored_path = "."
-        for root, _, files in os.walk(t_dir):
-            for fname in files:
-                lower = fname.lower()
-                if lower in ("docker-compose.yml", "docker-compose.yaml"):
-                    app_type = "docker_compose"
-                    stored_path = os.path.relpath(os.path.join(root, fname), t_dir)
-                    break
-                if lower == "dockerfile":
-                    app_type = "docker"
-                    break
-            if app_type != "gradio":
-                break
+    return await start_uploaded_app(
+        app_id,
+        app_dir,
+        file_location,
+        name=name,
+        description=description,
+        allow_ips=allow_ips,
+        auth_header=auth_header,
+        vram_required=vram_required,
+    )
+
+
+@app.post("/upload/stream")
+async def upload_app_stream(
+    request: Request,
+    name: str,
+    filename: str,
+    description: str = "",
+    allow_ips: str = None,
+    auth_header: str = None,
+    vram_required: int = 0,
+    current_user: dict = Depends(get_current_user),
+):
+    """Like ``/upload`` but the request body is the raw file.
+
+    Metadata travels in the query string, so the body is written straight to
+    disk as it arrives instead of being spooled by the multipart parser.
+    """
+    filename = os.path.basename(filename)
+    if not is_allowed_filename(filename):
+        raise HTTPException(status_code=400, detail="invalid filename")
+    app_id = str(uuid.uuid4())
+    app_dir = os.path.join(UPLOAD_DIR, app_id)
+    os.makedirs(app_dir, exist_ok=True)
+    file_location = os.path.join(app_dir, filename)
+    await save_stream(request.stream(), file_location)
+
+    return await start_uploaded_app(
+        app_id,
+        app_dir,
+        file_location,
+        name=name,
+        description=description,
+        allow_ips=allow_ips,
+        auth_header=auth_header,
+        vram_required=vram_required,
+    )
+
+
+def _chunk_count(size: int) -> int:
+    return -(-size // UPLOAD_CHUNK_SIZE)
 
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute(
-        "INSERT INTO templates(id, name, type, path, description, vram_required) VALUES(?,?,?,?,?,?)",
+
+def _missing_chunks(bits: bytes, count: int) -> List[int]:
+    return [i for i in range(count) if not bits[i >> 3] >> (i & 7) & 1]
+
+
+def _chunk_size(size: int, seq: int) -> int:
+    """Expected length of part ``seq`` of an upload of ``size`` bytes."""
+    return min(UPLOAD_CHUNK_SIZE, size - seq * UPLOAD_CHUNK_SIZE)
+
+
+async def _mark_chunk(upload_id: str, seq: int) -> bool:
+    """Record part ``seq`` of an upload as received."""
+    # One statement, so concurrent parts cannot overwrite each other's bit
+    return bool(
+        await db_write(
+            "UPDATE uploads SET chunks=set_bit(chunks, ?), updated=? WHERE id=?"
+            " RETURNING id",
+            (seq, time.time(), upload_id),
+        )
+    )
+
+
+@app.post("/upload/init")
+async def upload_init(
+    name: str = Form(...),
+    filename: str = Form(...),
+    size: int = Form(...),
+    description: str = Form(""),
+    allow_ips: str = Form(None),
+    auth_header: str = Form(None),
+    vram_required: int = Form(0),
+    current_user: dict = Depends(get_current_user),
+):
+    """Start a chunked upload; parts are sent with ``PUT /upload/{id}/{seq}``."""
+    filename = os.path.basename(filename)
+    if not is_allowed_filename(filename):
+        raise HTTPException(status_code=400, detail="invalid filename")
+    if size <= 0:
+        raise HTTPException(status_code=400, detail="invalid size")
+    upload_id = str(uuid.uuid4())
+    os.makedirs(os.path.join(UPLOAD_DIR, upload_id, "parts"), exist_ok=True)
+    await db_write(
+        "INSERT INTO uploads(id, filename, size, chunks, name, description,"
+        " allow_ips, auth_header, vram_required, updated)"
+        " VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
         (
-            template_id,
-            name.strip(),
-            app_type,
-            stored_path,
-            description.strip(),
+            upload_id,
+            filename,
+            size,
+            bytes((_chunk_count(size) + 7) // 8),
+            name,
+            description,
+            allow_ips,
+            auth_header,
             vram_required,
+            time.time(),
         ),
     )
-    conn.commit()
-    conn.close()
+    return {
+        "upload_id": upload_id,
+        "chunk_size": UPLOAD_CHUNK_SIZE,
+        "chunks": _chunk_count(size),
+    }
+
+
+@app.get("/upload/{upload_id}")
+async def upload_progress(upload_id: str, current_user: dict = Depends(get_current_user)):
+    """List the parts still missing, so an interrupted upload can resume."""
+    row = db_fetchone("SELECT size, chunks FROM uploads WHERE id=?", (upload_id,))
+    if not row:
+        raise HTTPException(status_code=404, detail="upload not found")
+    return {"missing": _missing_chunks(row[1], _chunk_count(row[0]))}
+
+
+@app.put("/upload/{upload_id}/{seq}")
+async def upload_chunk(
+    upload_id: str,
+    seq: int,
+    request: Request,
+    current_user: dict = Depends(get_current_user),
+):
+    """Store one part of a chunked upload; parts may arrive in any order."""
+    row = db_fetchone("SELECT size FROM uploads WHERE id=?", (upload_id,))
+    if not row:
+        raise HTTPException(status_code=404, detail="upload not found")
+    if not 0 <= seq < _chunk_count(row[0]):
+        raise HTTPException(status_code=400, detail="invalid chunk")
+    limit = _chunk_size(row[0], seq)
+    if int(request.headers.get("content-length") or 0) > limit:
+        raise HTTPException(status_code=413, detail="chunk too large")
+    part = os.path.join(UPLOAD_DIR, upload_id, "parts", str(seq))
+    # Received under a temporary name, so a bad re-send of a part cannot
+    # replace a good copy
+    tmp = f"{part}.{uuid.uuid4().hex}"
+    if await save_stream(request.stream(), tmp, limit) != limit:
+        await asyncio.to_thread(os.remove, tmp)
+        raise HTTPException(status_code=400, detail="chunk size mismatch")
+    await asyncio.to_thread(os.replace, tmp, part)
+    if not await _mark_chunk(upload_id, seq):
+        raise HTTPException(status_code=404, detail="upload not found")
+    return {"detail": "ok"}
+
+
+@app.post("/upload/{upload_id}/complete")
+async def upload_complete(upload_id: str, current_user: dict = Depends(get_current_user)):
+    """Join the parts of a chunked upload and start the app like ``/upload``."""
+    row = db_fetchone("SELECT size, chunks FROM uploads WHERE id=?", (upload_id,))
+    if not row:
+        raise HTTPException(status_code=404, detail="upload not found")
+    count = _chunk_count(row[0])
+    missing = _missing_chunks(row[1], count)
+    if missing:
+        raise HTTPException(status_code=409, detail={"missing": missing})
+    # Claim the upload so a repeated complete call cannot start it twice; the
+    # row itself stays until the parts are joined, so a failed join can be
+    # retried
+    rows = await db_write(
+        "UPDATE uploads SET claimed=1, updated=? WHERE id=? AND claimed=0"
+        " RETURNING filename, size, name, description, allow_ips, auth_header,"
+        " vram_required",
+        (time.time(), upload_id),
+    )
+    if not rows:
+        if db_fetchone("SELECT id FROM uploads WHERE id=?", (upload_id,)):
+            raise HTTPException(status_code=409, detail="upload already completing")
+        raise HTTPException(status_code=404, detail="upload not found")
+    filename, size, name, description, allow_ips, auth_header, vram_required = rows[0]
+
+    app_dir = os.path.join(UPLOAD_DIR, upload_id)
+    parts_dir = os.path.join(app_dir, "parts")
+    file_location = os.path.join(app_dir, filename)
+    parts = [os.path.join(parts_dir, str(i)) for i in range(count)]
+    try:
+        await asyncio.to_thread(join_parts, parts, file_location)
+        joined = os.path.getsize(file_location)
+    except OSError:
+        joined = None
+    if joined != size:
+        # Keep the parts and the row so the upload can still be completed
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(file_location)
+        await db_write("UPDATE uploads SET claimed=0 WHERE id=?", (upload_id,))
+        if joined is None:
+            raise HTTPException(status_code=500, detail="could not join upload parts")
+        raise HTTPException(status_code=400, detail="upload size mismatch")
+    await db_write("DELETE FROM uploads WHERE id=?", (upload_id,))
+    await purge_path(parts_dir)
+
+    return await start_uploaded_app(
+        upload_id,
+        app_dir,
+        file_location,
+        name=name,
+        description=description,
+        allow_ips=allow_ips,
+        auth_header=auth_header,
+        vram_required=vram_required,
+    )
+
+
+@app.post("/templates")
+async def upload_template(
+    name: str = Form(...),
+    file: UploadFile = File(...),
+    description: str = Form(""),
+    vram_required: int = Form(0),
+    current_user: dict = Depends(get_current_user),
+):
+    """Upload a template archive or file."""
+    template_id = str(uuid.uuid4())
+    filename = os.path.basename(file.filename)
+    if not is_allowed_filename(filename):
+        raise HTTPException(status_code=400, detail="invalid filename")
+    t_dir = os.path.join(TEMPLATE_STAGING_DIR, template_id)
+    os.makedirs(t_dir, exist_ok=True)
+    try:
+        file_location = os.path.join(t_dir, filename)
+        await asyncio.to_thread(copy_upload, file.file, file_location)
+
+        app_type, marker = await asyncio.to_thread(
+            _extract_and_detect, file_location, t_dir, "template"
+        )
+        if app_type == "docker_tar":
+            stored_path = filename
+        elif app_type == "docker_compose":
+            stored_path = os.path.relpath(marker, t_dir)
+        else:
+            stored_path = "."
+
+        await db_write(
+            "INSERT INTO templates(id, name, type, path, description, vram_required) VALUES(?,?,?,?,?,?)",
+            (
+                template_id,
+                name.strip(),
+                app_type,
+                stored_path,
+                description.strip(),
+                vram_required,
+            ),
+        )
+    except Exception:
+        await purge_path(t_dir)
+        raise
+    os.replace(t_dir, os.path.join(TEMPLATE_DIR, template_id))
 
     return {"template_id": template_id}
 
 
 @app.delete("/templates/{template_id}")
-async def delete_template(template_id: str):
+async def delete_template(template_id: str, background_tasks: BackgroundTasks):
     """Remove a saved template and its files."""
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute("SELECT id FROM templates WHERE id=?", (template_id,))
-    if not c.fetchone():
-        conn.close()
+    if not db_fetchone("SELECT id FROM templates WHERE id=?", (template_id,)):
         raise HTTPException(status_code=404, detail="template not found")
-    c.execute("DELETE FROM templates WHERE id=?", (template_id,))
-    conn.commit()
-    conn.close()
-
-    force_rmtree(os.path.join(TEMPLATE_DIR, template_id))
+    # Move the files out of TEMPLATE_DIR first, so a listing while the row is
+    # being deleted cannot register them again
+    trash = _move_to_trash(os.path.join(TEMPLATE_DIR, template_id), template_id)
+    await db_write("DELETE FROM templates WHERE id=?", (template_id,))
+    if trash:
+        background_tasks.add_task(purge_path, trash)
 
     return {"detail": "deleted"}
 
 
+def _accepts_gzip(accept_encoding: str) -> bool:
+    """Whether an Accept-Encoding header allows gzip, honouring q-values."""
+    wildcard = None
+    for coding in accept_encoding.split(","):
+        name, *params = coding.split(";")
+        name = name.strip().lower()
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name in ("gzip", "x-gzip"):
+            return q > 0
+        if name == "*":
+            wildcard = q > 0
+    return bool(wildcard)
+
+
 @app.get("/templates")
-async def list_templates():
-    ensure_templates()
-
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute("SELECT id, name, description, type, vram_required FROM templates")
-    rows = c.fetchall()
-    conn.close()
-    return [
-        {
-            "id": row[0],
-            "name": row[1],
-            "description": row[2] or "",
-            "type": row[3],
-            "vram_required": row[4] or 0,
-        }
-        for row in rows
-    ]
+async def list_templates(request: Request):
+    global TEMPLATES_CACHE
+    await ensure_templates()
+
+    if TEMPLATES_CACHE is None:
+        with DB_LOCK:
+            rows = DB.execute(
+                "SELECT id, name, description, type, vram_required FROM templates"
+            ).fetchall()
+        templates = [
+            {
+                "id": row[0],
+                "name": row[1],
+                "description": row[2] or "",
+                "type": row[3],
+                "vram_required": row[4] or 0,
+            }
+            for row in rows
+        ]
+        body = orjson.dumps(templates)
+        TEMPLATES_CACHE = body, gzip.compress(body)
+    body, compressed = TEMPLATES_CACHE
+    # Sent with either body, so shared caches keep the two apart
+    headers = {"Vary": "Accept-Encoding"}
+    if _accepts_gzip(request.headers.get("accept-encoding", "")):
+        body = compressed
+        headers["Content-Encoding"] = "gzip"
+    return Response(body, media_type="application/json", headers=headers)
 
 
 async def _deploy_template_impl(template_id: str, vram_required: int | None):
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute(
+    row = db_fetchone(
         "SELECT name, type, path, description, vram_required FROM templates WHERE id=?",
         (template_id,),
     )
-    row = c.fetchone()
-    conn.close()
     if not row:
         raise HTTPException(status_code=404, detail="template not found")
     name, app_type, stored_path, description, template_vram = row
 
     app_id = str(uuid.uuid4())
     app_dir = os.path.join(UPLOAD_DIR, app_id)
-    shutil.copytree(os.path.join(TEMPLATE_DIR, template_id), app_dir)
+    await asyncio.to_thread(copy_tree, os.path.join(TEMPLATE_DIR, template_id), app_dir)
 
     log_path = os.path.join(LOG_DIR, f"{app_id}.log")
-    with PORT_LOCK:
-        if not AVAILABLE_PORTS:
-            raise HTTPException(status_code=503, detail="no available ports")
-        port = None
-        while AVAILABLE_PORTS:
-            candidate = AVAILABLE_PORTS.pop()
-            if is_port_free(candidate):
-                port = candidate
-                break
-        if port is None:
-            raise HTTPException(status_code=503, detail="no available ports")
+    port = await allocate_port()
 
     if vram_required is None:
         vram_required = template_vram
-
     url = f"/apps/{app_id}/"
-    save_status(
-        app_id,
-        "uploaded",
-        log_path,
-        port=port,
-        name=name,
-        url=url,
-        app_type=app_type,
-        vram_required=vram_required,
-        description=description.strip() if description else None,
-    )
+    # App names are unique; tell repeated deployments of a template apart
+    for candidate in (name, f"{name}-{app_id[:8]}"):
+        if await insert_app(
+            app_id,
+            candidate,
+            "building",
+            log_path,
+            port,
+            url,
+            app_type,
+            description=description.strip() if description else None,
+            vram_required=vram_required,
+        ):
+            break
+    else:
+        release_port(port)
+        await purge_path(app_dir)
+        raise HTTPException(status_code=400, detail="app name already exists")
 
     if app_type == "docker_compose" and stored_path and stored_path != ".":
         run_path = os.path.join(app_dir, os.path.dirname(stored_path))
@@ -851,71 +1539,37 @@ async def _deploy_template_impl(template_id: str, vram_required: int | None):
         run_path = os.path.join(app_dir, stored_path) if stored_path and stored_path != "." else app_dir
 
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(
-                f"{AGENT_URL}/run",
-                json={
-                    "app_id": app_id,
-                    "path": run_path,
-                    "type": app_type,
-                    "log_path": log_path,
-                    "port": port,
-                    "allow_ips": None,
-                    "auth_header": None,
-                    "vram_required": vram_required,
-                },
-                timeout=AGENT_TIMEOUT,
-            )
-            resp.raise_for_status()
-        save_status(
-            app_id,
-            "building",
-            log_path,
-            app_type=app_type,
-            vram_required=vram_required,
-            description=description.strip() if description else None,
+        resp = await AGENT_CLIENT.post(
+            "/run",
+            json={
+                "app_id": app_id,
+                "path": run_path,
+                "type": app_type,
+                "log_path": log_path,
+                "port": port,
+                "allow_ips": None,
+                "auth_header": None,
+                "vram_required": vram_required,
+            },
         )
+        resp.raise_for_status()
     except httpx.ConnectError:
-        with PORT_LOCK:
-            AVAILABLE_PORTS.add(port)
-        save_status(
-            app_id,
-            "error",
-            log_path,
-            app_type=app_type,
-            vram_required=vram_required,
-            description=description.strip() if description else None,
-        )
+        release_port(port)
+        await db_write(_MARK_ERROR, (app_id,))
         raise HTTPException(
             status_code=502,
             detail="Unable to reach agent. Please ensure the agent is running and reachable.",
         )
     except httpx.TimeoutException:
-        with PORT_LOCK:
-            AVAILABLE_PORTS.add(port)
-        save_status(
-            app_id,
-            "error",
-            log_path,
-            app_type=app_type,
-            vram_required=vram_required,
-            description=description.strip() if description else None,
-        )
+        release_port(port)
+        await db_write(_MARK_ERROR, (app_id,))
         raise HTTPException(
             status_code=504,
             detail="Agent request timed out. Please make sure the agent is running.",
         )
     except Exception as e:
-        with PORT_LOCK:
-            AVAILABLE_PORTS.add(port)
-        save_status(
-            app_id,
-            "error",
-            log_path,
-            app_type=app_type,
-            vram_required=vram_required,
-            description=description.strip() if description else None,
-        )
+        release_port(port)
+        await db_write(_MARK_ERROR, (app_id,))
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -932,49 +1586,75 @@ async def deploy_template(template_id: str, vram_required: int | None = Form(Non
 
 @app.post("/update_status")
 async def update_status(update: StatusUpdate):
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute("SELECT id FROM apps WHERE id=?", (update.app_id,))
-    row = c.fetchone()
-    conn.close()
+    row = db_fetchone("SELECT id FROM apps WHERE id=?", (update.app_id,))
     if not row:
         raise HTTPException(status_code=404, detail="app not found")
 
-    heartbeat_time = time.time() if update.status == "running" else None
-    save_status(update.app_id, update.status, heartbeat=heartbeat_time, gpus=update.gpus)
+    gpus = ",".join(map(str, update.gpus)) if update.gpus is not None else None
+    await db_write(_UPDATE_STATUS_GPUS, (update.status, gpus, update.app_id))
+    if update.status == "running":
+        # Counts as a heartbeat; written with the next batch
+        PENDING_HB[update.app_id] = now = time.time()
+        track_heartbeat(update.app_id, now)
     if update.status in ("error", "finished", "stopped"):
-        release_app_port(update.app_id)
+        untrack_heartbeat(update.app_id)
+        await release_app_port(update.app_id)
     return {"detail": "ok"}
 
 
 @app.post("/heartbeat")
 async def heartbeat(hb: Heartbeat):
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute("SELECT id FROM apps WHERE id=?", (hb.app_id,))
-    row = c.fetchone()
-    conn.close()
+    row = db_fetchone("SELECT id FROM apps WHERE id=?", (hb.app_id,))
     if not row:
         raise HTTPException(status_code=404, detail="app not found")
 
-    save_status(hb.app_id, heartbeat=time.time())
+    PENDING_HB[hb.app_id] = now = time.time()
+    track_heartbeat(hb.app_id, now)
     return {"detail": "ok"}
 
 
+def track_heartbeat(app_id: str, ts: float):
+    """Push back the deadline by which ``app_id`` must send a heartbeat."""
+    HB_DEADLINE[app_id] = ts + HEARTBEAT_TIMEOUT
+    if app_id not in HB_QUEUED:
+        heapq.heappush(HB_HEAP, (ts + HEARTBEAT_TIMEOUT, app_id))
+        HB_QUEUED.add(app_id)
+        if HB_WAKE is not None:
+            HB_WAKE.set()
+
+
+def untrack_heartbeat(app_id: str):
+    """Stop watching ``app_id``; its heap entry is dropped when it surfaces."""
+    HB_DEADLINE.pop(app_id, None)
+
+
+async def flush_heartbeats():
+    """Write buffered heartbeats to the database in a single transaction."""
+    global PENDING_HB
+    if not PENDING_HB:
+        return
+    pending, PENDING_HB = PENDING_HB, {}
+    await db_write(
+        _UPDATE_HEARTBEAT, list(pending.items()), many=True
+    )
+
+
+async def heartbeat_flush_task():
+    """Periodically persist buffered heartbeats."""
+    while True:
+        await asyncio.sleep(HEARTBEAT_FLUSH_INTERVAL)
+        await flush_heartbeats()
+
+
 @app.post("/stop")
 async def stop_app(req: StopRequest, background_tasks: BackgroundTasks):
     # It might be good to add a check here if app_id from req.app_id exists, similar to stop_app_by_id.
     # For now, proceeding as per the direct conversion of existing logic.
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute("SELECT id FROM apps WHERE id=?", (req.app_id,))
-    row = c.fetchone()
+    row = db_fetchone("SELECT id FROM apps WHERE id=?", (req.app_id,))
     if not row:
-        conn.close()
         raise HTTPException(status_code=404, detail="app not found")
-    conn.close()
 
-    save_status(req.app_id, "stopping")
+    await db_write(_UPDATE_STATUS, ("stopping", req.app_id))
     background_tasks.add_task(_stop_agent_and_update_status, req.app_id)
     return {"detail": "stopping process initiated"}
 
@@ -982,57 +1662,122 @@ async def stop_app(req: StopRequest, background_tasks: BackgroundTasks):
 async def _stop_agent_and_update_status(app_id: str):
     """Helper function to stop agent and update status in the background."""
     try:
-        async with httpx.AsyncClient() as client:
-            await client.post(
-                f"{AGENT_URL}/stop",
-                json={"app_id": app_id},
-                timeout=30,
-            )
+        await AGENT_CLIENT.post(
+            "/stop",
+            json={"app_id": app_id},
+            timeout=30,
+        )
     except Exception as e:
         # Log this error or handle it more gracefully
         # For now, we'll proceed to update status to avoid app being stuck in "stopping"
         print(f"Error stopping agent for {app_id}: {e}")
-        save_status(app_id, "error", gpus=None)  # Or a more specific error status
-        release_app_port(app_id)
+        await db_write(_UPDATE_STATUS, ("error", app_id))  # Or a more specific error status
+        await release_app_port(app_id)
         return
 
-    save_status(app_id, "stopped", gpus=None)
-    release_app_port(app_id)
+    await db_write(_UPDATE_STATUS, ("stopped", app_id))
+    await release_app_port(app_id)
+
+
+def _status_body() -> bytes:
+    """Return the JSON body of ``/status``, serializing it only after changes."""
+    global STATUS_CACHE
+    if STATUS_CACHE is not None:
+        return STATUS_CACHE
+    with DB_LOCK:
+        rows = DB.execute(
+            "SELECT id, name, status, COALESCE(url, '/apps/' || id || '/'), gpus,"
+            " COALESCE(description, '') FROM apps"
+        ).fetchall()
+    apps = [
+        {
+            "id": app_id,
+            "name": name,
+            "status": status,
+            "url": url,
+            "gpus": list(map(int, gpus.split(","))) if gpus else [],
+            "description": description,
+        }
+        for app_id, name, status, url, gpus, description in rows
+    ]
+    STATUS_CACHE = orjson.dumps(apps)
+    return STATUS_CACHE
 
 
 @app.get("/status")
 async def get_status():
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute("SELECT id, name, description, status, url, gpus FROM apps")
-    rows = c.fetchall()
-    conn.close()
-    return [
-        {
-            "id": row[0],
-            "name": row[1],
-            "status": row[3],
-            "url": row[4] or f"/apps/{row[0]}/",
-            "gpus": [int(x) for x in row[5].split(',')] if row[5] else [],
-            "description": row[2] or "",
-        }
-        for row in rows
-    ]
+    return Response(_status_body(), media_type="application/json")
+
 
+@app.get("/status/stream")
+async def status_stream():
+    """Server-sent events carrying the ``/status`` list whenever it changes."""
 
-@app.get("/logs/{app_id}", response_class=PlainTextResponse)
-async def get_logs(app_id: str):
+    async def events():
+        while True:
+            # Taken before reading so a change made meanwhile is not missed
+            changed = STATUS_CHANGED
+            yield b"data: " + _status_body() + b"\n\n"
+            while True:
+                try:
+                    await asyncio.wait_for(changed.wait(), 15)
+                    break
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"  # keeps idle proxies from closing it
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def _tail_offset(path: str, lines: int) -> int:
+    """Return the byte offset at which the last ``lines`` lines of a file start."""
+    with open(path, "rb") as f:
+        pos = end = f.seek(0, os.SEEK_END)
+        found = 0
+        while pos > 0:
+            size = min(1 << 16, pos)
+            pos -= size
+            f.seek(pos)
+            chunk = f.read(size)
+            if pos + size == end and chunk.endswith(b"\n"):
+                # A trailing newline terminates the last line, it does not start one
+                chunk = chunk[:-1]
+            idx = len(chunk)
+            while (idx := chunk.rfind(b"\n", 0, idx)) >= 0:
+                found += 1
+                if found == lines:
+                    return pos + idx + 1
+    return 0
+
+
+def _iter_file(path: str, offset: int = 0, chunk_size: int = 1 << 16):
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while chunk := f.read(chunk_size):
+            yield chunk
+
+
+@app.get("/logs/{app_id}")
+async def get_logs(app_id: str, tail: int | None = None):
+    """Return an app's log, or only its last ``tail`` lines."""
     log_file = os.path.join(LOG_DIR, f"{app_id}.log")
-    if not os.path.exists(log_file):
+    try:
+        if tail:
+            offset = await asyncio.to_thread(_tail_offset, log_file, tail)
+            return StreamingResponse(
+                _iter_file(log_file, offset), media_type="text/plain"
+            )
+        st = os.stat(log_file)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="log not found")
-    with open(log_file) as f:
-        return f.read()
+    # FileResponse streams the file (with Range support) instead of reading it
+    # into memory; handing it our stat result saves it another stat() call
+    return FileResponse(log_file, media_type="text/plain", stat_result=st)
 
 
 @app.get("/files/{app_id}/{filename}")
 async def download_file(app_id: str, filename: str):
     """Return a file from the uploads directory as an attachment."""
-    if not ALLOWED_FILENAME.fullmatch(filename):
+    if not is_allowed_filename(filename):
         raise HTTPException(status_code=400, detail="invalid filename")
     path = os.path.join(UPLOAD_DIR, app_id, filename)
     if not os.path.exists(path):
@@ -1043,16 +1788,11 @@ async def download_file(app_id: str, filename: str):
 @app.post("/stop/{app_id}")
 async def stop_app_by_id(app_id: str, background_tasks: BackgroundTasks):
     """Stop a running app via the agent and mark it stopped."""
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute("SELECT id FROM apps WHERE id=?", (app_id,))
-    row = c.fetchone()
+    row = db_fetchone("SELECT id FROM apps WHERE id=?", (app_id,))
     if not row:
-        conn.close()
         raise HTTPException(status_code=404, detail="app not found")
-    conn.close()
 
-    save_status(app_id, "stopping")
+    await db_write(_UPDATE_STATUS, ("stopping", app_id))
     background_tasks.add_task(_stop_agent_and_update_status, app_id)
     return {"detail": "stopping process initiated"}
 
@@ -1060,18 +1800,13 @@ async def stop_app_by_id(app_id: str, background_tasks: BackgroundTasks):
 @app.post("/restart/{app_id}")
 async def restart_app(app_id: str):
     """Restart a previously uploaded app using its existing image."""
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute(
+    row = db_fetchone(
         "SELECT type, log_path, port, allow_ips, auth_header, vram_required FROM apps WHERE id=?",
         (app_id,),
     )
-    row = c.fetchone()
     if not row:
-        conn.close()
         raise HTTPException(status_code=404, detail="app not found")
     app_type, log_path, stored_port, allow_ips_str, auth_header, vram_required = row
-    conn.close()
 
     allowed = [ip.strip() for ip in allow_ips_str.split(",")] if allow_ips_str else None
 
@@ -1082,53 +1817,31 @@ async def restart_app(app_id: str):
             raise HTTPException(status_code=500, detail="tar file missing")
         run_path = os.path.join(app_dir, files[0])
     elif app_type == "docker_compose":
-        compose = None
-        for root, _, files in os.walk(app_dir):
-            for fname in files:
-                if fname.lower() in ("docker-compose.yml", "docker-compose.yaml"):
-                    compose = os.path.join(root, fname)
-                    break
-            if compose:
-                break
+        compose = find_file(app_dir, _COMPOSE_NAMES.__contains__)
         if not compose:
             raise HTTPException(status_code=500, detail="compose file missing")
         run_path = os.path.dirname(compose)
     else:
         run_path = app_dir
 
-    port = stored_port if stored_port and is_port_free(stored_port) else None
-    with PORT_LOCK:
-        if port is not None and port in AVAILABLE_PORTS:
-            AVAILABLE_PORTS.remove(port)
-        if port is None:
-            if not AVAILABLE_PORTS:
-                raise HTTPException(status_code=503, detail="no available ports")
-            while AVAILABLE_PORTS:
-                candidate = AVAILABLE_PORTS.pop()
-                if is_port_free(candidate):
-                    port = candidate
-                    break
-            if port is None:
-                raise HTTPException(status_code=503, detail="no available ports")
+    port = await allocate_port(stored_port)
 
     try:
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(
-                f"{AGENT_URL}/restart",
-                json={
-                    "app_id": app_id,
-                    "path": run_path,
-                    "type": app_type,
-                    "log_path": log_path,
-                    "port": port,
-                    "allow_ips": allowed,
-                    "auth_header": auth_header,
-                    "vram_required": vram_required,
-                },
-                timeout=AGENT_TIMEOUT,
-            )
-            resp.raise_for_status()
-        save_status(
+        resp = await AGENT_CLIENT.post(
+            "/restart",
+            json={
+                "app_id": app_id,
+                "path": run_path,
+                "type": app_type,
+                "log_path": log_path,
+                "port": port,
+                "allow_ips": allowed,
+                "auth_header": auth_header,
+                "vram_required": vram_required,
+            },
+        )
+        resp.raise_for_status()
+        await save_status(
             app_id,
             "building",
             log_path,
@@ -1139,17 +1852,8 @@ async def restart_app(app_id: str):
             vram_required=vram_required,
         )
     except Exception as e:
-        with PORT_LOCK:
-            AVAILABLE_PORTS.add(port)
-        save_status(
-            app_id,
-            "error",
-            log_path,
-            app_type=app_type,
-            allow_ips=allow_ips_str,
-            auth_header=auth_header,
-            vram_required=vram_required,
-        )
+        release_port(port)
+        await db_write(_MARK_ERROR, (app_id,))
         raise HTTPException(status_code=500, detail=str(e))
 
     return {"detail": "restarting", "url": f"/apps/{app_id}/"}
@@ -1158,114 +1862,124 @@ async def restart_app(app_id: str):
 @app.post("/save_template/{app_id}")
 async def save_template_from_app(app_id: str):
     """Save an uploaded app as a reusable template."""
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute(
+    row = db_fetchone(
         "SELECT name, description, type, vram_required FROM apps WHERE id=?",
         (app_id,),
     )
-    row = c.fetchone()
-    conn.close()
     if not row:
         raise HTTPException(status_code=404, detail="app not found")
     name, description, app_type, vram_required = row
 
     template_id = str(uuid.uuid4())
     src_dir = os.path.join(UPLOAD_DIR, app_id)
-    dst_dir = os.path.join(TEMPLATE_DIR, template_id)
-    shutil.copytree(src_dir, dst_dir)
+    # Copied into staging and moved into TEMPLATE_DIR once the row exists
+    dst_dir = os.path.join(TEMPLATE_STAGING_DIR, template_id)
+    try:
+        await asyncio.to_thread(copy_tree, src_dir, dst_dir)
+
+        if app_type == "docker_tar":
+            files = [f for f in os.listdir(dst_dir) if f.endswith(".tar")]
+            if not files:
+                raise HTTPException(status_code=500, detail="tar file missing")
+            stored_path = files[0]
+        else:
+            stored_path = "."
+            detected, marker = detect_app_type(dst_dir)
+            if detected != "gradio":
+                app_type = detected
+            if detected == "docker_compose":
+                stored_path = os.path.relpath(marker, dst_dir)
+
+        await db_write(
+            "INSERT INTO templates(id, name, type, path, description, vram_required) VALUES(?,?,?,?,?,?)",
+            (
+                template_id,
+                name,
+                app_type,
+                stored_path,
+                description or "",
+                vram_required or 0,
+            ),
+        )
+    except Exception:
+        await purge_path(dst_dir)
+        raise
+    os.replace(dst_dir, os.path.join(TEMPLATE_DIR, template_id))
 
-    if app_type == "docker_tar":
-        files = [f for f in os.listdir(dst_dir) if f.endswith(".tar")]
-        if not files:
-            force_rmtree(dst_dir)
-            raise HTTPException(status_code=500, detail="tar file missing")
-        stored_path = files[0]
-    else:
-        stored_path = "."
-        for root, _, files in os.walk(dst_dir):
-            for fname in files:
-                lower = fname.lower()
-                if lower in ("docker-compose.yml", "docker-compose.yaml"):
-                    app_type = "docker_compose"
-                    stored_path = os.path.relpath(os.path.join(root, fname), dst_dir)
-                    break
-                if lower == "dockerfile":
-                    app_type = "docker"
-                    break
-            if app_type != "gradio":
-                break
+    return {"template_id": template_id}
 
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute(
-        "INSERT INTO templates(id, name, type, path, description, vram_required) VALUES(?,?,?,?,?,?)",
-        (
-            template_id,
-            name,
-            app_type,
-            stored_path,
-            description or "",
-            vram_required or 0,
-        ),
+
+async def _detach_app(app_id: str, status: str):
+    """Stop a running app on the agent, or just drop its proxy route."""
+    path = "/stop" if status == "running" else "/remove_route"
+    try:
+        await AGENT_CLIENT.post(path, json={"app_id": app_id}, timeout=5)
+    except Exception:
+        pass
+
+
+async def _delete_apps(apps: dict[str, str], background_tasks: BackgroundTasks):
+    """Delete apps given as ``{app_id: status}`` along with their files.
+
+    Agent calls for all apps go out concurrently, and both DELETEs are queued
+    together so they commit in one write batch.
+    """
+    await asyncio.gather(*(_detach_app(i, st) for i, st in apps.items()))
+
+    ids = list(apps)
+    for app_id in ids:
+        PENDING_HB.pop(app_id, None)
+        untrack_heartbeat(app_id)
+    marks = ",".join("?" * len(ids))
+    deleted, _ = await asyncio.gather(
+        db_write(f"DELETE FROM apps WHERE id IN ({marks}) RETURNING port", ids),
+        db_write(f"DELETE FROM app_heartbeat WHERE id IN ({marks})", ids),
     )
-    conn.commit()
-    conn.close()
+    for (port,) in deleted:
+        if port is not None:
+            release_port(port)
 
-    return {"template_id": template_id}
+    for app_id in ids:
+        # Move the files out of the way so the response does not wait for
+        # the (potentially slow) recursive delete
+        trash = _move_to_trash(os.path.join(UPLOAD_DIR, app_id), app_id)
+        if trash:
+            background_tasks.add_task(purge_path, trash)
+
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(LOG_DIR, f"{app_id}.log"))
 
 
 @app.delete("/apps/{app_id}")
-async def delete_app(app_id: str):
+async def delete_app(app_id: str, background_tasks: BackgroundTasks):
     """Delete an app and all its data."""
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute("SELECT status FROM apps WHERE id=?", (app_id,))
-    row = c.fetchone()
+    row = db_fetchone("SELECT status FROM apps WHERE id=?", (app_id,))
     if not row:
-        conn.close()
         raise HTTPException(status_code=404, detail="app not found")
-    status = row[0]
-    conn.close()
-
-    if status == "running":
-        try:
-            async with httpx.AsyncClient() as client:
-                await client.post(
-                    f"{AGENT_URL}/stop",
-                    json={"app_id": app_id},
-                    timeout=AGENT_TIMEOUT,
-                )
-        except Exception:
-            pass
-    else:
-        # Ensure the proxy route is removed for non-running apps
-        try:
-            async with httpx.AsyncClient() as client:
-                await client.post(
-                    f"{AGENT_URL}/remove_route",
-                    json={"app_id": app_id},
-                    timeout=AGENT_TIMEOUT,
-                )
-        except Exception:
-            pass
-
-    release_app_port(app_id)
+    await _delete_apps({app_id: row[0]}, background_tasks)
+    return {"detail": "deleted"}
 
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute("DELETE FROM apps WHERE id=?", (app_id,))
-    conn.commit()
-    conn.close()
 
-    app_path = os.path.join(UPLOAD_DIR, app_id)
-    force_rmtree(app_path)
+class BulkDelete(BaseModel):
+    app_ids: List[str]
 
-    log_file = os.path.join(LOG_DIR, f"{app_id}.log")
-    if os.path.exists(log_file):
-        os.remove(log_file)
 
-    return {"detail": "deleted"}
+@app.post("/apps/bulk_delete")
+async def bulk_delete_apps(req: BulkDelete, background_tasks: BackgroundTasks):
+    """Delete several apps at once; unknown ids are skipped."""
+    ids = list(dict.fromkeys(req.app_ids))
+    if not ids:
+        return {"deleted": []}
+    with DB_LOCK:
+        apps = dict(
+            DB.execute(
+                f"SELECT id, status FROM apps WHERE id IN ({','.join('?' * len(ids))})",
+                ids,
+            )
+        )
+    if apps:
+        await _delete_apps(apps, background_tasks)
+    return {"deleted": list(apps)}
 
 
 class EditApp(BaseModel):
@@ -1284,110 +1998,204 @@ class EditTemplate(BaseModel):
 @app.post("/edit_app")
 async def edit_app(info: EditApp, current_user: dict = Depends(get_current_user)):
     """Update app name and description."""
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute("SELECT id FROM apps WHERE id=?", (info.app_id,))
-    if not c.fetchone():
-        conn.close()
-        raise HTTPException(status_code=404, detail="app not found")
-    c.execute(
-        "SELECT id FROM apps WHERE name=? AND id!=?", (info.name.strip(), info.app_id)
-    )
-    if c.fetchone():
-        conn.close()
+    try:
+        rows = await db_write(
+            "UPDATE apps SET name=?, description=? WHERE id=? RETURNING id",
+            (info.name.strip(), info.description.strip(), info.app_id),
+        )
+    except sqlite3.IntegrityError:
         raise HTTPException(status_code=400, detail="app name already exists")
-    conn.close()
-    save_status(
-        info.app_id, name=info.name.strip(), description=info.description.strip()
-    )
+    if not rows:
+        raise HTTPException(status_code=404, detail="app not found")
     return {"detail": "updated"}
 
 
 @app.post("/edit_template")
 async def edit_template(info: EditTemplate):
     """Update template metadata."""
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute("SELECT id FROM templates WHERE id=?", (info.template_id,))
-    if not c.fetchone():
-        conn.close()
-        raise HTTPException(status_code=404, detail="template not found")
-    c.execute(
-        "SELECT id FROM templates WHERE name=? AND id!=?",
-        (info.name.strip(), info.template_id),
-    )
-    if c.fetchone():
-        conn.close()
-        raise HTTPException(status_code=400, detail="template name already exists")
-    c.execute(
-        "UPDATE templates SET name=?, description=?, vram_required=? WHERE id=?",
+    name = info.name.strip()
+    # The name check and the update run as one statement in the writer
+    if not await db_write(
+        "UPDATE templates SET name=?, description=?, vram_required=? WHERE id=?"
+        " AND NOT EXISTS (SELECT 1 FROM templates WHERE name=? AND id!=?)"
+        " RETURNING id",
         (
-            info.name.strip(),
+            name,
             info.description.strip(),
             info.vram_required,
             info.template_id,
+            name,
+            info.template_id,
         ),
-    )
-    conn.commit()
-    conn.close()
+    ):
+        if db_fetchone("SELECT id FROM templates WHERE id=?", (info.template_id,)):
+            raise HTTPException(status_code=400, detail="template name already exists")
+        raise HTTPException(status_code=404, detail="template not found")
     return {"detail": "updated"}
 
 
+# Running apps whose last heartbeat is older than the cutoff
+_STALE = (
+    "status='running' AND NOT EXISTS"
+    " (SELECT 1 FROM app_heartbeat h WHERE h.id=apps.id AND h.ts>=?)"
+)
+
+
+async def _stop_one(app_id: str):
+    """Stop a stale app on the agent, falling back to removing its route."""
+    # Attempt to stop the app on the agent so lingering processes and
+    # proxy routes are cleaned up. If stopping fails (e.g. the agent no
+    # longer has a record of the app), fall back to removing the proxy
+    # route directly.
+    try:
+        resp = await AGENT_CLIENT.post("/stop", json={"app_id": app_id})
+        resp.raise_for_status()
+    except Exception:
+        await AGENT_CLIENT.post("/remove_route", json={"app_id": app_id})
+
+
+def _pop_expired(now: float) -> list[str]:
+    """Pop the apps whose heartbeat deadline has passed off HB_HEAP."""
+    expired = []
+    while HB_HEAP and HB_HEAP[0][0] <= now:
+        _, app_id = heapq.heappop(HB_HEAP)
+        HB_QUEUED.discard(app_id)
+        deadline = HB_DEADLINE.get(app_id)
+        if deadline is None:
+            continue  # untracked since it was queued
+        if deadline > now:
+            # Heartbeats arrived meanwhile; queue it again at its real deadline
+            heapq.heappush(HB_HEAP, (deadline, app_id))
+            HB_QUEUED.add(app_id)
+        else:
+            del HB_DEADLINE[app_id]
+            expired.append(app_id)
+    return expired
+
+
 async def cleanup_task():
-    """Periodically check for apps without heartbeat and mark them as error."""
+    """Mark running apps as error once their heartbeat deadline passes.
+
+    Sleeps until the earliest deadline in HB_HEAP instead of polling, so
+    only expired apps are looked at.
+    """
     while True:
-        await asyncio.sleep(30)
-        cutoff = time.time() - 60
-        conn = sqlite3.connect(DATABASE)
-        c = conn.cursor()
-        c.execute(
-            "SELECT id FROM apps WHERE status='running' AND (last_heartbeat IS NULL OR last_heartbeat<?)",
-            (cutoff,),
-        )
-        stale = [row[0] for row in c.fetchall()]
+        if not HB_HEAP:
+            HB_WAKE.clear()
+            await HB_WAKE.wait()
+            continue
+        delay = HB_HEAP[0][0] - time.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+            continue
+        now = time.time()
+        expired = _pop_expired(now)
+        if not expired:
+            continue
+        cutoff = now - HEARTBEAT_TIMEOUT
+        # Make buffered heartbeats visible to the staleness check
+        await flush_heartbeats()
+        # The database has the final say: only apps still running without a
+        # recent heartbeat are marked. RETURNING reports the updated row, so
+        # read the ports to free first.
+        marks = ",".join("?" * len(expired))
+        with DB_LOCK:
+            ports = dict(
+                DB.execute(
+                    f"SELECT id, port FROM apps WHERE {_STALE} AND id IN ({marks})",
+                    (cutoff, *expired),
+                )
+            )
+        if not ports:
+            continue
+        stale = [
+            row[0]
+            for row in await db_write(
+                f"UPDATE apps SET status='error', gpus=NULL, port=NULL WHERE {_STALE}"
+                f" AND id IN ({','.join('?' * len(ports))}) RETURNING id",
+                (cutoff, *ports),
+            )
+        ]
         for app_id in stale:
-            c.execute("UPDATE apps SET status='error', gpus=NULL WHERE id=?", (app_id,))
-            conn.commit()
-            release_app_port(app_id)
-            # Attempt to stop the app on the agent so lingering processes and
-            # proxy routes are cleaned up. If stopping fails (e.g. the agent no
-            # longer has a record of the app), fall back to removing the proxy
-            # route directly.
-            try:
-                async with httpx.AsyncClient() as client:
-                    resp = await client.post(
-                        f"{AGENT_URL}/stop",
-                        json={"app_id": app_id},
-                        timeout=AGENT_TIMEOUT,
-                    )
-                    resp.raise_for_status()
-            except Exception:
-                try:
-                    async with httpx.AsyncClient() as client:
-                        await client.post(
-                            f"{AGENT_URL}/remove_route",
-                            json={"app_id": app_id},
-                            timeout=AGENT_TIMEOUT,
-                        )
-                except Exception:
-                    pass
-        conn.close()
+            if ports[app_id] is not None:
+                release_port(ports[app_id])
+        await asyncio.gather(*map(_stop_one, stale), return_exceptions=True)
+
+
+async def expire_uploads() -> List[str]:
+    """Discard chunked uploads that saw no activity for UPLOAD_EXPIRY seconds."""
+    rows = await db_write(
+        "DELETE FROM uploads WHERE updated IS NULL OR updated<? RETURNING id",
+        (time.time() - UPLOAD_EXPIRY,),
+    )
+    for (upload_id,) in rows:
+        trash = _move_to_trash(os.path.join(UPLOAD_DIR, upload_id), upload_id)
+        if trash:
+            await purge_path(trash)
+    return [row[0] for row in rows]
+
+
+async def expire_uploads_task():
+    while True:
+        await expire_uploads()
+        await asyncio.sleep(min(UPLOAD_EXPIRY, 3600))
 
 
 @app.on_event("startup")
 async def startup_event():
-    # Remove ports for any apps that are already running
-    conn = sqlite3.connect(DATABASE)
-    c = conn.cursor()
-    c.execute("SELECT port FROM apps WHERE status='running' AND port IS NOT NULL")
-    rows = c.fetchall()
-    conn.close()
-    for row in rows:
-        port = row[0]
-        if port in AVAILABLE_PORTS:
-            AVAILABLE_PORTS.remove(port)
+    global AGENT_CLIENT, WRITE_Q, HB_WAKE
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="backend-io")
+    )
+    # Keep connections to the agent alive across requests
+    limits = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+    transport = (
+        httpx.AsyncHTTPTransport(uds=AGENT_SOCK, limits=limits) if AGENT_SOCK else None
+    )
+    AGENT_CLIENT = httpx.AsyncClient(
+        base_url=AGENT_URL, timeout=AGENT_TIMEOUT, limits=limits, transport=transport
+    )
 
+    # Remove ports for any apps that are already running
+    with DB_LOCK:
+        rows = DB.execute(
+            "SELECT port FROM apps WHERE status='running' AND port IS NOT NULL"
+        ).fetchall()
+    take_ports(row[0] for row in rows)
+
+    # Watch running apps; ones that never sent a heartbeat get a full timeout
+    HB_WAKE = asyncio.Event()
+    now = time.time()
+    with DB_LOCK:
+        rows = DB.execute(
+            "SELECT a.id, h.ts FROM apps a LEFT JOIN app_heartbeat h ON h.id=a.id"
+            " WHERE a.status='running'"
+        ).fetchall()
+    for app_id, ts in rows:
+        track_heartbeat(app_id, ts if ts is not None else now)
+
+    # Finish deletions interrupted by a previous shutdown
+    for entry in os.listdir(TRASH_DIR):
+        asyncio.create_task(purge_path(os.path.join(TRASH_DIR, entry)))
+    # and templates whose upload never finished
+    for entry in os.listdir(TEMPLATE_STAGING_DIR):
+        asyncio.create_task(purge_path(os.path.join(TEMPLATE_STAGING_DIR, entry)))
+
+    WRITE_Q = asyncio.Queue()
+    asyncio.create_task(writer_task())
+    asyncio.create_task(heartbeat_flush_task())
     asyncio.create_task(cleanup_task())
+    asyncio.create_task(expire_uploads_task())
+
+    # Register template folders added while the server was down
+    await ensure_templates()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await flush_heartbeats()
+    if AGENT_CLIENT is not None:
+        await AGENT_CLIENT.aclose()
 
 
 # Example: run with `uvicorn backend.main:app --reload`
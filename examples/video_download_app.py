@@ -10,9 +10,19 @@ app = FastAPI()
 
 @app.get("/download")
 def download():
-    if not os.path.exists(VIDEO_PATH):
+    # Stat on every request so a replaced video is never sent with a stale
+    # size; handing the result to FileResponse saves it a second stat, and it
+    # still sends the file with sendfile and answers Range requests
+    try:
+        video_stat = os.stat(VIDEO_PATH)
+    except FileNotFoundError:
         return {"error": "video not found"}
-    return FileResponse(VIDEO_PATH, media_type="video/mp4", filename=os.path.basename(VIDEO_PATH))
+    return FileResponse(
+        VIDEO_PATH,
+        media_type="video/mp4",
+        filename=os.path.basename(VIDEO_PATH),
+        stat_result=video_stat,
+    )
 
 
 def generate_video(text):
@@ -68,6 +68,38 @@
       return response;
     };
 
+    // 큰 파일은 여러 조각으로 나눠 병렬 업로드 (실패한 조각만 다시 전송)
+    const CHUNKED_UPLOAD_MIN = 64 * 1024 * 1024;
+    const CHUNK_UPLOAD_PARALLEL = 4;
+    const uploadChunked = async (file, fields, onProgress) => {
+      const form = new FormData();
+      Object.entries({ ...fields, filename: file.name, size: file.size })
+        .forEach(([k, v]) => form.append(k, v));
+      const init = await apiFetch('/upload/init', { method: 'POST', body: form });
+      if (!init.ok) return init;
+      const { upload_id, chunk_size, chunks } = await init.json();
+      const queue = [...Array(chunks).keys()];
+      let done = 0;
+      const worker = async () => {
+        while (queue.length) {
+          const seq = queue.shift();
+          const body = file.slice(seq * chunk_size, (seq + 1) * chunk_size);
+          for (let attempt = 0; ; attempt++) {
+            try {
+              const res = await apiFetch(`/upload/${upload_id}/${seq}`, { method: 'PUT', body });
+              if (res.ok) break;
+              if (attempt >= 2) throw new Error('chunk ' + seq + ' failed');
+            } catch (err) {
+              if (attempt >= 2) throw err;
+            }
+          }
+          onProgress(++done / chunks);
+        }
+      };
+      await Promise.all(Array.from({ length: CHUNK_UPLOAD_PARALLEL }, worker));
+      return apiFetch(`/upload/${upload_id}/complete`, { method: 'POST' });
+    };
+
     // [FIXED] 로그인/등록 폼 컴포넌트 분리
     const AuthForm = ({ isRegister, username, password, setUsername, setPassword, handleLogin, handleRegister, setMode }) => (
         <div className="min-h-screen flex items-center justify-center bg-slate-950 p-4">
@@ -319,28 +351,36 @@
             fetchData();
         }, [token]);
 
+        const applyStatus = (data) => {
+            const existingIds = new Set(data.map(a => a.id));
+            const remainingDeploying = deployingApps.filter(d => !existingIds.has(d.id));
+            setDeployingApps(remainingDeploying);
+            const newDeployingTemplates = { ...deployingTemplates };
+            Object.entries(deployingTemplates).forEach(([tid, aid]) => {
+                if (existingIds.has(aid)) delete newDeployingTemplates[tid];
+            });
+            setDeployingTemplates(newDeployingTemplates);
+            setApps([...remainingDeploying, ...data]);
+        };
+
         const refreshStatus = async () => {
             try {
                 const res = await apiFetch('/status');
-                const data = await res.json();
-                const existingIds = new Set(data.map(a => a.id));
-                const remainingDeploying = deployingApps.filter(d => !existingIds.has(d.id));
-                setDeployingApps(remainingDeploying);
-                const newDeployingTemplates = { ...deployingTemplates };
-                Object.entries(deployingTemplates).forEach(([tid, aid]) => {
-                    if (existingIds.has(aid)) delete newDeployingTemplates[tid];
-                });
-                setDeployingTemplates(newDeployingTemplates);
-                setApps([...remainingDeploying, ...data]);
+                applyStatus(await res.json());
             } catch (error) {
                 console.error("Failed to refresh status:", error);
             }
         };
 
+        // 폴링 대신 서버가 상태 변경 시 보내주는 이벤트 구독 (연결이 끊기면 브라우저가 자동 재연결)
+        // 연결은 한 번만 열고, 최신 상태를 쓰는 applyStatus는 ref로 참조
+        const applyStatusRef = useRef(applyStatus);
+        applyStatusRef.current = applyStatus;
         useEffect(() => {
-            const interval = setInterval(refreshStatus, 1000);
-            return () => clearInterval(interval);
-        }, [deployingApps, deployingTemplates]);
+            const source = new EventSource('/status/stream');
+            source.onmessage = (e) => applyStatusRef.current(JSON.parse(e.data));
+            return () => source.close();
+        }, []);
         
         const handleDragOver = (e) => { e.preventDefault(); e.stopPropagation(); if (!dragActive) setDragActive(true); };
         const handleDragLeave = (e) => { e.preventDefault(); e.stopPropagation(); setDragActive(false); };
@@ -362,17 +402,22 @@
             setUploadMsg('Upload started...');
             setUploadProgress(50);
         
-            const formData = new FormData();
-            formData.append('name', name);
-            formData.append('description', description);
-            formData.append('file', files[0]);
-            formData.append('vram_required', vramRequired);
+            const file = files[0];
+            const fields = { name, description, vram_required: vramRequired };
         
             try {
-                const res = await apiFetch('/upload', {
-                    method: 'POST',
-                    body: formData,
-                });
+                let res;
+                if (file.size >= CHUNKED_UPLOAD_MIN) {
+                    setUploadProgress(1);
+                    res = await uploadChunked(file, fields, p => setUploadProgress(Math.max(1, Math.round(p * 95))));
+                } else {
+                    // 파일은 요청 본문으로 그대로 보내고 메타데이터는 쿼리 문자열로 전달
+                    const params = new URLSearchParams({ ...fields, filename: file.name });
+                    res = await apiFetch('/upload/stream?' + params, {
+                        method: 'POST',
+                        body: file,
+                    });
+                }
 
                 const data = await res.json();
 
@@ -410,7 +455,8 @@
                 setShowLogs(prev => ({ ...prev, [appId]: false })); return;
             }
             try {
-                const res = await apiFetch(`/logs/${appId}`);
+                // 로그 패널에는 마지막 부분만 표시되므로 전체 파일을 받지 않음
+                const res = await apiFetch(`/logs/${appId}?tail=1000`);
                 const text = await res.text();
                 setLogs(prev => ({ ...prev, [appId]: text }));
                 setShowLogs(prev => ({ ...prev, [appId]: true }));
@@ -1,8 +1,26 @@
+import atexit
+import ipaddress
 import os
 import json
+import mmap
+import queue
+import re
 import subprocess
 import logging
 import threading
+import urllib.request
+
+try:
+    import orjson
+
+    _loads, _dumps = orjson.loads, orjson.dumps
+except ImportError:  # the agent may run without orjson installed
+
+    def _loads(data):
+        return json.loads(bytes(data))
+
+    def _dumps(obj):
+        return json.dumps(obj).encode()
 
 ROUTES_FILE = os.environ.get(
     "ROUTES_FILE", os.path.join(os.path.dirname(__file__), "routes.json")
@@ -13,13 +31,57 @@ CONFIG_PATH = os.environ.get(
 # Path where nginx will read the config; defaults to /etc/nginx/conf.d/apps.conf
 LINK_PATH = os.environ.get("PROXY_LINK_PATH", "/etc/nginx/conf.d/apps.conf")
 
-# Serialize access to routes and config generation
+# "reload" regenerates apps.conf and reloads Nginx on route changes; "lua"
+# installs nginx_lua.conf once (needs OpenResty) and pushes changes to its
+# admin endpoint instead
+PROXY_MODE = os.environ.get("PROXY_MODE", "reload")
+LUA_TEMPLATE = os.path.join(os.path.dirname(__file__), "nginx_lua.conf")
+# Address of the admin server in nginx_lua.conf; keep it off public interfaces
+ADMIN_LISTEN = os.environ.get("PROXY_ADMIN_LISTEN", "127.0.0.1:8081")
+
+# App IDs are interpolated into the Nginx config and URLs unescaped
+_APP_ID_RE = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+# Talks to ADMIN_LISTEN directly, ignoring any *_proxy environment variables
+_ADMIN_OPENER = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+
+# Serialize access to routes
 ROUTE_LOCK = threading.Lock()
+# Serialize config writes and reloads; taken before ROUTE_LOCK, never inside it
+CONFIG_LOCK = threading.Lock()
+# Route changes within this many seconds share one config write and reload
+RELOAD_DELAY = float(os.environ.get("PROXY_RELOAD_DELAY", 0.2))
+# Pending reload timer, if any; guarded by ROUTE_LOCK
+_RELOAD_TIMER = None
+# Last `nginx -s reload` process, reaped on the next reload
+_RELOAD_PROC = None
+# (st_mtime_ns, routes) of ROUTES_FILE as last read or written
+_ROUTES_CACHE = None
+# Routes saved but not yet written to ROUTES_FILE; guarded by ROUTE_LOCK
+_ROUTES_PENDING = None
+# Wakes the background routes.json writer
+_WRITE_Q = queue.Queue()
+# Whether this process installed the Lua config yet; guarded by CONFIG_LOCK
+_LUA_READY = False
+# Route changes (app_id -> route, None to remove) not yet pushed to Nginx in
+# lua mode; guarded by ROUTE_LOCK
+_PUSH_PENDING = {}
+# Delay before retrying failed pushes; doubles from PUSH_RETRY_MIN up to
+# PUSH_RETRY_MAX seconds while Nginx keeps refusing them
+PUSH_RETRY_MIN = 1.0
+PUSH_RETRY_MAX = 30.0
+_PUSH_RETRY = PUSH_RETRY_MIN
+# Whether LINK_PATH was verified to point at CONFIG_PATH
+_LINK_OK = False
 
 
 def ensure_link():
-    """Create or update symlink for Nginx to load the generated config."""
-    if CONFIG_PATH == LINK_PATH:
+    """Create or update symlink for Nginx to load the generated config.
+
+    Only checked until it succeeds once per process.
+    """
+    global _LINK_OK
+    if _LINK_OK or CONFIG_PATH == LINK_PATH:
         return
     try:
         if os.path.islink(LINK_PATH):
@@ -31,87 +93,405 @@ def ensure_link():
             if os.path.exists(LINK_PATH):
                 os.unlink(LINK_PATH)
             os.symlink(CONFIG_PATH, LINK_PATH)
+        _LINK_OK = True
     except PermissionError:
         logging.warning("Permission denied creating Nginx config link")
 
 
 def load_routes():
-    if os.path.exists(ROUTES_FILE):
-        with open(ROUTES_FILE) as f:
-            return json.load(f)
-    return {}
+    """Return a copy of the routes, re-reading the file only when it changed."""
+    global _ROUTES_CACHE
+    pending = _ROUTES_PENDING
+    if pending is not None:
+        return dict(pending)
+    try:
+        mtime = os.stat(ROUTES_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    cached = _ROUTES_CACHE
+    if cached is None or cached[0] != mtime:
+        with open(ROUTES_FILE, "rb") as f:
+            cached = _ROUTES_CACHE = (mtime, _read_routes_file(f))
+    return dict(cached[1])
+
+
+def _read_routes_file(f):
+    """Parse an open routes file, mapping it rather than reading it into a copy."""
+    size = os.fstat(f.fileno()).st_size
+    if not size:
+        return {}
+    with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+        with memoryview(mm) as view:
+            return _loads(view)
 
 
 def save_routes(routes):
+    """Record new routes; the background writer persists them to ROUTES_FILE.
+
+    Must be called with ROUTE_LOCK held. Changes made while a write is
+    pending are folded into the next one.
+    """
+    global _ROUTES_PENDING
+    _ROUTES_PENDING = dict(routes)
+    _WRITE_Q.put(None)
+
+
+def _write_routes_tmp(routes):
     os.makedirs(os.path.dirname(ROUTES_FILE), exist_ok=True)
-    with open(ROUTES_FILE, "w") as f:
-        json.dump(routes, f)
+    # Write a temp file and rename it over the old one, so readers (other
+    # processes, Nginx's Lua init) never see a half-written file
+    tmp = f"{ROUTES_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(_dumps(routes))
+        # Durable before the rename; this runs on the writer thread, so one
+        # fsync covers a whole burst of route changes
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp
+
 
+def _commit_routes(routes, tmp):
+    """Move ``tmp`` into place unless newer routes superseded it.
 
+    Must be called with ROUTE_LOCK held.
+    """
+    global _ROUTES_PENDING, _ROUTES_CACHE
+    if _ROUTES_PENDING is not routes:
+        os.unlink(tmp)
+        return
+    os.replace(tmp, ROUTES_FILE)
+    _ROUTES_PENDING = None
+    _ROUTES_CACHE = (os.stat(ROUTES_FILE).st_mtime_ns, routes)
 
 
-def generate_config(routes):
-    lines = ["server {", "    listen 8080;"]
+def flush_routes():
+    """Write pending route changes to ROUTES_FILE without waiting for the writer."""
+    with ROUTE_LOCK:
+        routes = _ROUTES_PENDING
+    if routes is None:
+        return
+    # Serialize and write outside the lock; only the rename happens under it
+    tmp = _write_routes_tmp(routes)
+    with ROUTE_LOCK:
+        _commit_routes(routes, tmp)
+
+
+def _routes_writer():
+    while True:
+        _WRITE_Q.get()
+        # Everything queued so far is covered by one write of the latest routes
+        while True:
+            try:
+                _WRITE_Q.get_nowait()
+            except queue.Empty:
+                break
+        try:
+            flush_routes()
+        except OSError as e:
+            logging.error("Could not save proxy routes: %s", e)
+
+
+threading.Thread(target=_routes_writer, name="routes-writer", daemon=True).start()
+atexit.register(flush_routes)
+
+
+_LOC_TMPL = """\
+    location = /apps/{aid} {{
+        return 301 /apps/{aid}/;
+    }}
+    location /apps/{aid}/ {{
+        rewrite ^/apps/{aid}/(.*)$ /$1 break;
+        proxy_pass http://127.0.0.1:{port}/;
+        proxy_http_version 1.1;
+        proxy_set_header Upgrade $http_upgrade;
+        proxy_set_header Connection "upgrade";
+        proxy_set_header Host $host;
+        proxy_set_header X-Real-IP $remote_addr;
+        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;
+        proxy_set_header X-Forwarded-Proto $scheme;
+        proxy_set_header Range $http_range;
+        proxy_set_header If-Range $http_if_range;
+        proxy_buffering off;
+"""
+_ALLOW_TMPL = "        allow {ip};\n"
+_AUTH_TMPL = "        if ($http_{header} = '') {{ return 403; }}\n"
+
+_HEADER = b"server {\n    listen 8080;\n"
+_FOOTER = b"}"
+
+# app_id -> (route, rendered location blocks); only used under CONFIG_LOCK
+_FRAG_CACHE = {}
+# Chunks of the config Nginx last reloaded successfully; guarded by CONFIG_LOCK
+_LOADED_CONFIG = None
+
+
+def _render_route(app_id, info):
+    parts = [_LOC_TMPL.format(aid=app_id, port=info["port"])]
+    if info.get("allow_ips"):
+        for ip in info["allow_ips"]:
+            parts.append(_ALLOW_TMPL.format(ip=ip))
+        parts.append("        deny all;\n")
+    if info.get("auth_header"):
+        header = info["auth_header"].replace('-', '_').lower()
+        parts.append(_AUTH_TMPL.format(header=header))
+    parts.append("    }\n")
+    return "".join(parts).encode()
+
+
+def render_config(routes):
+    """Return the Nginx server block for ``routes`` as a list of byte chunks.
+
+    Each route's location blocks are cached, so only new or changed routes
+    are formatted again. The chunks are never joined: they are compared
+    with and written to the config file one by one.
+    """
+    global _FRAG_CACHE
+    frags = {}
     for app_id, info in routes.items():
-        lines.append(f"    location = /apps/{app_id} {{")
-        lines.append(f"        return 301 /apps/{app_id}/;")
-        lines.append("    }")
-        lines.append(f"    location /apps/{app_id}/ {{")
-        lines.append(f"        rewrite ^/apps/{app_id}/(.*)$ /$1 break;")
-        lines.append(f"        proxy_pass http://127.0.0.1:{info['port']}/;")
-        lines.append("        proxy_http_version 1.1;")
-        lines.append("        proxy_set_header Upgrade $http_upgrade;")
-        lines.append('        proxy_set_header Connection \"upgrade\";')
-        lines.append("        proxy_set_header Host $host;")
-        lines.append("        proxy_set_header X-Real-IP $remote_addr;")
-        lines.append("        proxy_set_header X-Forwarded-For $proxy_add_x_forwarded_for;")
-        lines.append("        proxy_set_header X-Forwarded-Proto $scheme;")
-        lines.append("        proxy_set_header Range $http_range;")
-        lines.append("        proxy_set_header If-Range $http_if_range;")
-        lines.append("        proxy_buffering off;")
-        if info.get("allow_ips"):
-            for ip in info["allow_ips"]:
-                lines.append(f"        allow {ip};")
-            lines.append("        deny all;")
-        if info.get("auth_header"):
-            header = info["auth_header"].replace('-', '_').lower()
-            lines.append(f"        if ($http_{header} = '') {{ return 403; }}")
-        lines.append("    }")
-    lines.append("}")
+        cached = _FRAG_CACHE.get(app_id)
+        if cached is None or cached[0] != info:
+            cached = (info, _render_route(app_id, info))
+        frags[app_id] = cached
+    # Rebuilt each time so removed routes drop out of the cache
+    _FRAG_CACHE = frags
+    return [_HEADER, *(frag for _, frag in frags.values()), _FOOTER]
+
+
+def _file_matches(path, chunks):
+    """Whether ``path`` holds exactly the concatenation of ``chunks``."""
+    try:
+        with open(path, "rb") as f:
+            data = memoryview(f.read())
+    except FileNotFoundError:
+        return False
+    if len(data) != sum(map(len, chunks)):
+        return False
+    pos = 0
+    for chunk in chunks:
+        end = pos + len(chunk)
+        if data[pos:end] != chunk:
+            return False
+        pos = end
+    return True
+
+
+def generate_config(routes):
+    """Write the config for ``routes`` unless the file holds it; return its chunks."""
+    chunks = render_config(routes)
+    if not _file_matches(CONFIG_PATH, chunks):
+        os.makedirs(os.path.dirname(CONFIG_PATH), exist_ok=True)
+        tmp = f"{CONFIG_PATH}.{os.getpid()}.tmp"
+        with open(tmp, "wb", buffering=1 << 16) as f:
+            f.writelines(chunks)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, CONFIG_PATH)
+    ensure_link()
+    return chunks
+
+
+def generate_lua_config():
+    """Install the static Lua config; it reads routes from ROUTES_FILE."""
+    with open(LUA_TEMPLATE) as f:
+        conf = f.read()
+    conf = conf.replace("__ROUTES_FILE__", os.path.abspath(ROUTES_FILE))
+    conf = conf.replace("__ADMIN_LISTEN__", ADMIN_LISTEN)
     os.makedirs(os.path.dirname(CONFIG_PATH), exist_ok=True)
     with open(CONFIG_PATH, "w") as f:
-        f.write("\n".join(lines))
+        f.write(conf)
     ensure_link()
 
 
+def _post_route(app_id, route):
+    """Send one route change (``None`` removes it) to the admin endpoint."""
+    body = json.dumps({"app_id": app_id, "route": route}).encode()
+    req = urllib.request.Request(
+        f"http://{ADMIN_LISTEN}/_admin/route",
+        data=body,
+        headers={"Content-Type": "application/json"},
+    )
+    _ADMIN_OPENER.open(req, timeout=2).close()
+
+
+def _push_routes():
+    """Hand pending route changes to the running Nginx (lua mode).
+
+    Runs on the reload timer, outside ROUTE_LOCK. The first call installs
+    the Lua config and reloads once; Nginx then loads every route saved so
+    far from routes.json itself; if that reload fails, the next call starts
+    over. Pushes that fail, e.g. while that reload is still starting, are
+    kept and retried with a growing delay.
+    """
+    global _RELOAD_TIMER, _PUSH_PENDING, _LUA_READY, _PUSH_RETRY
+    with CONFIG_LOCK:
+        with ROUTE_LOCK:
+            _RELOAD_TIMER = None
+            pending, _PUSH_PENDING = _PUSH_PENDING, {}
+        if not _LUA_READY:
+            # Everything taken from _PUSH_PENDING is in routes.json once it
+            # is flushed; later changes stay pending and are pushed
+            flush_routes()
+            generate_lua_config()
+            if reload_proxy():
+                _LUA_READY = True
+                return
+            # Nginx is not running the Lua config, so there is no admin
+            # endpoint to push to; the next change tries installing it again
+            with ROUTE_LOCK:
+                _PUSH_PENDING = {**pending, **_PUSH_PENDING}
+            return
+        failed = {}
+        for app_id, route in pending.items():
+            try:
+                _post_route(app_id, route)
+            except OSError as e:
+                failed[app_id] = route
+                error = e
+        with ROUTE_LOCK:
+            if not failed:
+                _PUSH_RETRY = PUSH_RETRY_MIN
+                return
+            logging.warning(
+                "Could not update %d proxy route(s), retrying in %.1fs: %s",
+                len(failed),
+                _PUSH_RETRY,
+                error,
+            )
+            # Changes made since take precedence over the failed ones
+            _PUSH_PENDING = {**failed, **_PUSH_PENDING}
+            _schedule_reload(_PUSH_RETRY)
+            _PUSH_RETRY = min(_PUSH_RETRY * 2, PUSH_RETRY_MAX)
+
+
 def reload_proxy():
+    """Validate the config and signal Nginx to reload without waiting on it.
+
+    A config that fails ``nginx -t`` is logged and not loaded, so Nginx keeps
+    serving the previous one. Returns whether the reload was signalled.
+    """
+    global _RELOAD_PROC
     try:
-        subprocess.run(["nginx", "-s", "reload"], check=False)
+        check = subprocess.run(["nginx", "-t"], capture_output=True, text=True)
     except FileNotFoundError:
         logging.warning("Nginx not installed; skipping reload")
+        return False
+    if check.returncode != 0:
+        logging.error("Invalid Nginx config, not reloading: %s", check.stderr.strip())
+        return False
+    if _RELOAD_PROC is not None:
+        _RELOAD_PROC.poll()  # reap the previous signaller
+    _RELOAD_PROC = subprocess.Popen(
+        ["nginx", "-s", "reload"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return True
+
+
+def _do_reload():
+    """Write the config for the current routes and reload Nginx."""
+    global _RELOAD_TIMER, _LOADED_CONFIG
+    if PROXY_MODE == "lua":
+        _push_routes()
+        return
+    # Render and write outside ROUTE_LOCK so route changes never wait on
+    # disk or Nginx; changes made meanwhile schedule another reload
+    with CONFIG_LOCK:
+        with ROUTE_LOCK:
+            _RELOAD_TIMER = None
+            routes = load_routes()
+        chunks = generate_config(routes)
+        # Compared with what Nginx accepted rather than with the file, which
+        # may hold a config whose reload failed or predates this process
+        if chunks != _LOADED_CONFIG and reload_proxy():
+            _LOADED_CONFIG = chunks
+
+
+def _schedule_reload(delay=None):
+    """Reload Nginx shortly, folding in any other changes made meanwhile.
+
+    Must be called with ROUTE_LOCK held. A pending reload is not pushed back,
+    so a steady stream of changes still reloads every RELOAD_DELAY seconds.
+    In lua mode the "reload" pushes the pending route changes instead.
+    """
+    global _RELOAD_TIMER
+    if _RELOAD_TIMER is None:
+        _RELOAD_TIMER = threading.Timer(
+            RELOAD_DELAY if delay is None else delay, _do_reload
+        )
+        _RELOAD_TIMER.daemon = True
+        _RELOAD_TIMER.start()
+
+
+def flush_reload():
+    """Apply a pending reload now instead of waiting for the timer."""
+    with ROUTE_LOCK:
+        timer = _RELOAD_TIMER
+    if timer is not None:
+        timer.cancel()
+        _do_reload()
+
+
+# Timers are daemon threads; don't lose the last change on exit
+atexit.register(flush_reload)
+
+
+def _check_lua_allow_ips(allow_ips):
+    """Raise ValueError for allowlist entries nginx_lua.conf cannot match.
+
+    Its allowlist only understands IPv4 addresses and networks (and "all");
+    anything else would silently deny every client.
+    """
+    for entry in allow_ips:
+        if entry == "all":
+            continue
+        try:
+            net = ipaddress.ip_network(entry, strict=False)
+        except ValueError:
+            raise ValueError(f"invalid allow_ips entry: {entry!r}") from None
+        if net.version != 4:
+            raise ValueError(
+                f"IPv6 allow_ips entries are not supported with PROXY_MODE=lua: {entry!r}"
+            )
 
 
 def add_route(app_id, port, allow_ips=None, auth_header=None):
-    """Add a route for an app and reload the proxy."""
+    """Add a route for an app and schedule a proxy reload.
+
+    The reload only happens if the generated config actually changes.
+    Raises ValueError for an ``app_id`` that is not safe to put in the config.
+    """
+    if not _APP_ID_RE.fullmatch(app_id):
+        raise ValueError(f"invalid app id: {app_id!r}")
+    if PROXY_MODE == "lua" and allow_ips:
+        _check_lua_allow_ips(allow_ips)
     with ROUTE_LOCK:
         routes = load_routes()
-        routes[app_id] = {"port": port}
+        route = {"port": port}
         if allow_ips:
-            routes[app_id]["allow_ips"] = allow_ips
+            route["allow_ips"] = allow_ips
         if auth_header:
-            routes[app_id]["auth_header"] = auth_header
-        save_routes(routes)
-        generate_config(routes)
-        reload_proxy()
+            route["auth_header"] = auth_header
+        if routes.get(app_id) != route:
+            routes[app_id] = route
+            save_routes(routes)
+        if PROXY_MODE == "lua":
+            _PUSH_PENDING[app_id] = route
+        _schedule_reload()
     return port
 
 
 def remove_route(app_id):
-    """Remove an app's route and reload the proxy."""
+    """Remove an app's route and schedule a proxy reload.
+
+    Returns False, without touching files or Nginx, if the app had no route.
+    """
     with ROUTE_LOCK:
         routes = load_routes()
-        if app_id in routes:
-            routes.pop(app_id)
-            save_routes(routes)
-            generate_config(routes)
-            reload_proxy()
+        if routes.pop(app_id, None) is None:
+            return False
+        save_routes(routes)
+        if PROXY_MODE == "lua":
+            _PUSH_PENDING[app_id] = None
+        _schedule_reload()
+    return True
@@ -0,0 +1,168 @@
+"""Stub the backend's third-party dependencies and load backend/main.py, so
+tests can exercise its logic without installing them."""
+import atexit
+import importlib.util
+import os
+from pathlib import Path
+import shutil
+import sys
+import tempfile
+import types
+
+import pytest
+
+sys.modules.setdefault("httpx", types.ModuleType("httpx"))
+# Minimal pydantic stub
+pydantic_mod = types.ModuleType("pydantic")
+class _BaseModel:
+    pass
+pydantic_mod.BaseModel = _BaseModel
+sys.modules.setdefault("pydantic", pydantic_mod)
+# Minimal FastAPI stub to avoid heavy dependencies during import
+fastapi_mod = types.ModuleType("fastapi")
+
+class _FastAPI:
+    def __init__(self, *a, **k):
+        pass
+    def post(self, *a, **k):
+        def wrapper(f):
+            return f
+        return wrapper
+    def get(self, *a, **k):
+        def wrapper(f):
+            return f
+        return wrapper
+    def put(self, *a, **k):
+        def wrapper(f):
+            return f
+        return wrapper
+    def delete(self, *a, **k):
+        def wrapper(f):
+            return f
+        return wrapper
+    def on_event(self, *a, **k):
+        def wrapper(f):
+            return f
+        return wrapper
+    def mount(self, *a, **k):
+        pass
+
+class _UploadFile:
+    pass
+
+def _File(*a, **k):
+    pass
+
+class _HTTPException(Exception):
+    def __init__(self, status_code=None, detail=None, **k):
+        self.status_code = status_code
+        self.detail = detail
+
+def _Form(*a, **k):
+    pass
+
+class _BackgroundTasks:
+    pass
+
+class _Request:
+    pass
+
+def _Depends(*a, **k):
+    pass
+
+class _status:
+    HTTP_401_UNAUTHORIZED = 401
+
+fastapi_mod.FastAPI = _FastAPI
+fastapi_mod.UploadFile = _UploadFile
+fastapi_mod.File = _File
+fastapi_mod.HTTPException = _HTTPException
+fastapi_mod.Form = _Form
+fastapi_mod.BackgroundTasks = _BackgroundTasks
+fastapi_mod.Depends = _Depends
+fastapi_mod.Request = _Request
+fastapi_mod.status = _status
+sys.modules.setdefault("fastapi", fastapi_mod)
+sys.modules.setdefault("fastapi.responses", types.ModuleType("fastapi.responses"))
+sys.modules["fastapi.responses"].PlainTextResponse = object
+sys.modules["fastapi.responses"].FileResponse = object
+class _Response:
+    def __init__(self, content=None, status_code=200, headers=None, media_type=None):
+        self.body = content
+        self.status_code = status_code
+        self.headers = dict(headers or {})
+        self.media_type = media_type
+class _StreamingResponse(_Response):
+    def __init__(self, content, **k):
+        super().__init__(**k)
+        self.body_iterator = content
+sys.modules["fastapi.responses"].Response = _Response
+sys.modules["fastapi.responses"].StreamingResponse = _StreamingResponse
+sys.modules.setdefault("fastapi.staticfiles", types.ModuleType("fastapi.staticfiles"))
+class _StaticFiles:
+    def __init__(self, *a, **k):
+        pass
+sys.modules["fastapi.staticfiles"].StaticFiles = _StaticFiles
+sys.modules.setdefault("fastapi.security", types.ModuleType("fastapi.security"))
+sys.modules["fastapi.security"].OAuth2PasswordBearer = lambda *a, **k: None
+sys.modules["fastapi.security"].OAuth2PasswordRequestForm = object
+sys.modules.setdefault("passlib", types.ModuleType("passlib"))
+context_mod = types.ModuleType("passlib.context")
+class DummyCryptContext:
+    def __init__(self, *a, **k):
+        pass
+    def hash(self, pw):
+        return "hashed" + pw
+    def verify(self, pw, hashed):
+        return True
+context_mod.CryptContext = DummyCryptContext
+sys.modules.setdefault("passlib.context", context_mod)
+jose_mod = types.ModuleType("jose")
+class _JWTError(Exception):
+    pass
+jose_mod.JWTError = _JWTError
+jose_mod.jwt = types.SimpleNamespace(encode=lambda *a, **k: "", decode=lambda *a, **k: {})
+sys.modules.setdefault("jose", jose_mod)
+sys.modules.setdefault("jose.jwt", jose_mod.jwt)
+sys.modules.setdefault("multipart", types.ModuleType("multipart"))
+
+# Importing the backend opens its database and creates its directories;
+# keep them out of the working tree
+_DATA_DIR = tempfile.mkdtemp(prefix="backend-tests-")
+atexit.register(shutil.rmtree, _DATA_DIR, ignore_errors=True)
+for _var, _name in (
+    ("DATABASE_PATH", "app.db"),
+    ("UPLOAD_DIR", "uploads"),
+    ("LOG_DIR", "logs"),
+    ("TEMPLATE_DIR", "templates"),
+):
+    os.environ.setdefault(_var, os.path.join(_DATA_DIR, _name))
+
+spec = importlib.util.spec_from_file_location(
+    "backend.main",
+    Path(__file__).resolve().parents[1] / "backend" / "main.py",
+)
+_main = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(_main)
+
+
+@pytest.fixture
+def main(monkeypatch, tmp_path):
+    """The backend module with a fresh database and directories under tmp_path."""
+    for attr, name in (
+        ("DATABASE", "app.db"),
+        ("UPLOAD_DIR", "uploads"),
+        ("LOG_DIR", "logs"),
+        ("TEMPLATE_DIR", "templates"),
+    ):
+        monkeypatch.setattr(_main, attr, str(tmp_path / name))
+    monkeypatch.setattr(
+        _main, "TEMPLATE_STAGING_DIR", os.path.join(_main.TEMPLATE_DIR, ".staging")
+    )
+    monkeypatch.setattr(_main, "TRASH_DIR", os.path.join(_main.UPLOAD_DIR, ".trash"))
+    monkeypatch.setattr(_main, "STATUS_CACHE", None)
+    monkeypatch.setattr(_main, "TEMPLATES_CACHE", None)
+    monkeypatch.setattr(_main, "DB", None)
+    _main.init_db()
+    yield _main
+    _main.DB.close()
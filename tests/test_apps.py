@@ -0,0 +1,63 @@
+import asyncio
+import os
+import types
+import uuid
+
+
+class FakeAgent:
+    def __init__(self):
+        self.calls = []
+
+    async def post(self, path, json=None, **kwargs):
+        self.calls.append((path, json["app_id"]))
+
+
+class FakeTasks:
+    def __init__(self):
+        self.tasks = []
+
+    def add_task(self, func, *args):
+        self.tasks.append((func, args))
+
+
+def _port_taken(main, port):
+    i = port - main.PORT_START
+    return bool(main.PORT_BITMAP[i >> 3] & (1 << (i & 7)))
+
+
+def test_bulk_delete_releases_ports(main, monkeypatch):
+    agent = FakeAgent()
+    monkeypatch.setattr(main, "AGENT_CLIENT", agent)
+    monkeypatch.setattr(main, "PORT_BITMAP", bytearray(len(main.PORT_BITMAP)))
+
+    async def run():
+        apps = {}
+        for status in ("running", "stopped"):
+            app_id = uuid.uuid4().hex
+            port = await main.allocate_port()
+            assert await main.insert_app(
+                app_id, app_id, status, f"logs/{app_id}.log", port, None, "python"
+            )
+            os.makedirs(os.path.join(main.UPLOAD_DIR, app_id))
+            apps[app_id] = port
+        assert all(_port_taken(main, port) for port in apps.values())
+
+        tasks = FakeTasks()
+        res = await main.bulk_delete_apps(
+            types.SimpleNamespace(app_ids=[*apps, "missing", *apps]), tasks
+        )
+        return apps, res, tasks
+
+    apps, res, tasks = asyncio.run(run())
+    running, stopped = apps
+    assert sorted(res["deleted"]) == sorted(apps)
+    assert sorted(agent.calls) == sorted(
+        [("/stop", running), ("/remove_route", stopped)]
+    )
+    assert not any(_port_taken(main, port) for port in apps.values())
+    marks = ",".join("?" * len(apps))
+    assert main.db_fetchone(f"SELECT id FROM apps WHERE id IN ({marks})", list(apps)) is None
+    assert len(tasks.tasks) == 2
+    assert not any(
+        os.path.exists(os.path.join(main.UPLOAD_DIR, app_id)) for app_id in apps
+    )
@@ -0,0 +1,107 @@
+import asyncio
+import gzip
+import os
+import types
+import uuid
+
+import orjson
+
+
+async def _add_app(main, status="running"):
+    app_id = uuid.uuid4().hex
+    assert await main.insert_app(
+        app_id, app_id, status, f"logs/{app_id}.log", None, None, "python"
+    )
+    return app_id
+
+
+def _statuses(main):
+    return {app["id"]: app["status"] for app in orjson.loads(main._status_body())}
+
+
+def test_status_cache_follows_app_writes(main):
+    async def run():
+        app_id = await _add_app(main)
+        assert _statuses(main)[app_id] == "running"
+        cached = main.STATUS_CACHE
+        assert cached is not None and main._status_body() is cached
+
+        changed = main.STATUS_CHANGED
+        await main.db_write(main._UPDATE_STATUS, ("stopped", app_id))
+        assert main.STATUS_CACHE is None and changed.is_set()
+        assert _statuses(main)[app_id] == "stopped"
+
+        await main.db_write("DELETE FROM apps WHERE id=?", (app_id,))
+        assert app_id not in _statuses(main)
+
+    asyncio.run(run())
+
+
+def test_status_stream_pushes_changes(main):
+    async def run():
+        # start from an event created on this loop
+        main._status_changed()
+        app_id = await _add_app(main)
+        events = (await main.status_stream()).body_iterator
+        first = await events.__anext__()
+        assert first.startswith(b"data: ") and app_id.encode() in first
+
+        pending = asyncio.ensure_future(events.__anext__())
+        await asyncio.sleep(0)
+        assert not pending.done()
+        await main.db_write(main._UPDATE_STATUS, ("stopped", app_id))
+        update = orjson.loads((await asyncio.wait_for(pending, 1))[6:])
+        await events.aclose()
+        await main.db_write("DELETE FROM apps WHERE id=?", (app_id,))
+        return app_id, update
+
+    app_id, update = asyncio.run(run())
+    assert {"id": app_id, "status": "stopped"}.items() <= next(
+        app for app in update if app["id"] == app_id
+    ).items()
+
+
+def test_templates_cache_follows_template_writes(main):
+    plain = types.SimpleNamespace(headers={})
+    gzipped = types.SimpleNamespace(headers={"accept-encoding": "gzip, br"})
+
+    async def names():
+        res = await main.list_templates(plain)
+        return {t["id"]: t["name"] for t in orjson.loads(res.body)}
+
+    async def run():
+        tpl_id = uuid.uuid4().hex
+        await main.db_write(
+            "INSERT INTO templates(id, name, type, path) VALUES(?, ?, 'python', ?)",
+            (tpl_id, "before", os.path.join(main.TEMPLATE_DIR, tpl_id)),
+        )
+        assert main.TEMPLATES_CACHE is None
+        assert (await names())[tpl_id] == "before"
+
+        res = await main.list_templates(gzipped)
+        assert res.headers["Content-Encoding"] == "gzip"
+        assert res.headers["Vary"] == "Accept-Encoding"
+        assert gzip.decompress(res.body) == main.TEMPLATES_CACHE[0]
+        res = await main.list_templates(plain)
+        assert "Content-Encoding" not in res.headers
+        assert res.headers["Vary"] == "Accept-Encoding"
+
+        await main.edit_template(
+            types.SimpleNamespace(
+                template_id=tpl_id, name="after", description="", vram_required=0
+            )
+        )
+        assert main.TEMPLATES_CACHE is None
+        assert (await names())[tpl_id] == "after"
+
+        await main.db_write("DELETE FROM templates WHERE id=?", (tpl_id,))
+        assert tpl_id not in await names()
+
+    asyncio.run(run())
+
+
+def test_accepts_gzip(main):
+    for header in ("gzip", "br, GZIP;q=0.5", "*", "identity, *;q=0.1"):
+        assert main._accepts_gzip(header), header
+    for header in ("", "br", "gzip;q=0", "gzip; q=0.0, br", "*;q=0", "*, gzip;q=0"):
+        assert not main._accepts_gzip(header), header
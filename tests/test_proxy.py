@@ -0,0 +1,121 @@
+import json
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import proxy.proxy as proxy
+
+
+@pytest.fixture
+def reloads(monkeypatch, tmp_path):
+    """Point the proxy at tmp_path and count reloads instead of running Nginx."""
+    monkeypatch.setattr(proxy, "ROUTES_FILE", str(tmp_path / "routes.json"))
+    monkeypatch.setattr(proxy, "CONFIG_PATH", str(tmp_path / "apps.conf"))
+    monkeypatch.setattr(proxy, "LINK_PATH", str(tmp_path / "apps.conf"))
+    monkeypatch.setattr(proxy, "PROXY_MODE", "reload")
+    monkeypatch.setattr(proxy, "RELOAD_DELAY", 0.05)
+    monkeypatch.setattr(proxy, "_ROUTES_CACHE", None)
+    monkeypatch.setattr(proxy, "_FRAG_CACHE", {})
+    monkeypatch.setattr(proxy, "_LOADED_CONFIG", None)
+    calls = []
+
+    def reload_proxy():
+        calls.append(time.monotonic())
+        return True
+
+    monkeypatch.setattr(proxy, "reload_proxy", reload_proxy)
+    yield calls
+    # Nothing may be left to write once the paths are restored
+    proxy.flush_reload()
+    proxy.flush_routes()
+
+
+def test_reloads_are_debounced(reloads, tmp_path):
+    for i in range(5):
+        proxy.add_route(f"app{i}", 9000 + i)
+    proxy.remove_route("app4")
+    time.sleep(0.3)
+    assert len(reloads) == 1
+    conf = (tmp_path / "apps.conf").read_text()
+    assert all(f"/apps/app{i}/ " in conf for i in range(4))
+    assert "app4" not in conf
+
+    # Re-adding an identical route changes nothing, so Nginx is left alone
+    proxy.add_route("app0", 9000)
+    time.sleep(0.2)
+    assert len(reloads) == 1
+
+    proxy.add_route("app0", 9100)
+    proxy.flush_reload()
+    assert len(reloads) == 2
+    assert "127.0.0.1:9100/" in (tmp_path / "apps.conf").read_text()
+
+
+def test_failed_reload_is_retried(reloads, monkeypatch, tmp_path):
+    monkeypatch.setattr(proxy, "reload_proxy", lambda: reloads.append(0) and False)
+    proxy.add_route("app0", 9000)
+    proxy.flush_reload()
+    assert len(reloads) == 1
+    assert "127.0.0.1:9000/" in (tmp_path / "apps.conf").read_text()
+
+    # The file already matches, but Nginx never loaded it
+    monkeypatch.setattr(proxy, "reload_proxy", lambda: reloads.append(1) or True)
+    proxy.add_route("app0", 9000)
+    proxy.flush_reload()
+    assert reloads == [0, 1]
+    proxy.add_route("app0", 9000)
+    proxy.flush_reload()
+    assert reloads == [0, 1]
+
+
+def test_lua_config_is_installed_before_pushing(reloads, monkeypatch):
+    monkeypatch.setattr(proxy, "PROXY_MODE", "lua")
+    monkeypatch.setattr(proxy, "_LUA_READY", False)
+    monkeypatch.setattr(proxy, "_PUSH_PENDING", {})
+    pushed = []
+    monkeypatch.setattr(proxy, "_post_route", lambda *change: pushed.append(change))
+
+    # Nginx refused the Lua config: nothing is pushed and the change is kept
+    monkeypatch.setattr(proxy, "reload_proxy", lambda: reloads.append(0) and False)
+    proxy.add_route("app0", 9000)
+    proxy.flush_reload()
+    assert not proxy._LUA_READY and pushed == []
+    assert proxy._PUSH_PENDING == {"app0": {"port": 9000}}
+
+    # The next change installs it again; Nginx then reads app0 from routes.json
+    monkeypatch.setattr(proxy, "reload_proxy", lambda: reloads.append(1) or True)
+    proxy.add_route("app1", 9001)
+    proxy.flush_reload()
+    assert proxy._LUA_READY and pushed == [] and reloads == [0, 1]
+
+    proxy.add_route("app2", 9002)
+    proxy.flush_reload()
+    assert pushed == [("app2", {"port": 9002})] and reloads == [0, 1]
+
+
+def test_flush_routes_persists_pending_routes(reloads, tmp_path):
+    routes_file = tmp_path / "routes.json"
+    with proxy.ROUTE_LOCK:
+        proxy.save_routes({"a": {"port": 9000}})
+    proxy.flush_routes()
+    assert proxy._ROUTES_PENDING is None
+    assert json.loads(routes_file.read_bytes()) == {"a": {"port": 9000}}
+    assert proxy.load_routes() == {"a": {"port": 9000}}
+
+    # A write overtaken by newer routes is dropped, not renamed into place
+    stale = {"a": {"port": 9001}}
+    with proxy.ROUTE_LOCK:
+        proxy.save_routes(stale)
+        stale = proxy._ROUTES_PENDING
+    tmp = proxy._write_routes_tmp(stale)
+    with proxy.ROUTE_LOCK:
+        proxy.save_routes({"b": {"port": 9002}})
+        proxy._commit_routes(stale, tmp)
+    assert not os.path.exists(tmp)
+    assert proxy.load_routes() == {"b": {"port": 9002}}
+    proxy.flush_routes()
+    assert json.loads(routes_file.read_bytes()) == {"b": {"port": 9002}}
@@ -0,0 +1,177 @@
+import asyncio
+import os
+
+import pytest
+
+
+class FakeRequest:
+    """Just enough of a Request for upload_chunk: headers and a body stream."""
+
+    def __init__(self, body, send_length=True):
+        self.body = body
+        self.headers = {"content-length": str(len(body))} if send_length else {}
+
+    async def stream(self):
+        for i in range(0, len(self.body), 3):
+            yield self.body[i : i + 3]
+
+
+@pytest.fixture
+def uploads(main, monkeypatch):
+    monkeypatch.setattr(main, "UPLOAD_CHUNK_SIZE", 4)
+    started = []
+
+    async def fake_start(app_id, app_dir, file_location, **kwargs):
+        with open(file_location, "rb") as f:
+            started.append((app_id, f.read(), kwargs["name"]))
+        return {"app_id": app_id}
+
+    monkeypatch.setattr(main, "start_uploaded_app", fake_start)
+    return started
+
+
+async def _init(main, size):
+    res = await main.upload_init(
+        name="chunked",
+        filename="app.py",
+        size=size,
+        description="",
+        allow_ips=None,
+        auth_header=None,
+        vram_required=0,
+        current_user={},
+    )
+    return res["upload_id"], res["chunks"]
+
+
+async def _put(main, upload_id, seq, body, send_length=True):
+    return await main.upload_chunk(
+        upload_id, seq, FakeRequest(body, send_length), current_user={}
+    )
+
+
+def test_chunked_upload_out_of_order(main, uploads):
+    data = b"0123456789"
+
+    async def run():
+        upload_id, chunks = await _init(main, len(data))
+        assert chunks == 3
+        for seq in (2, 0):
+            await _put(main, upload_id, seq, data[seq * 4 : seq * 4 + 4])
+        progress = await main.upload_progress(upload_id, current_user={})
+        assert progress["missing"] == [1]
+        with pytest.raises(main.HTTPException) as exc:
+            await main.upload_complete(upload_id, current_user={})
+        assert exc.value.status_code == 409
+
+        await _put(main, upload_id, 1, data[4:8])
+        assert await main.upload_complete(upload_id, current_user={}) == {
+            "app_id": upload_id
+        }
+        return upload_id
+
+    upload_id = asyncio.run(run())
+    assert uploads == [(upload_id, data, "chunked")]
+    assert main.db_fetchone("SELECT id FROM uploads WHERE id=?", (upload_id,)) is None
+    assert not os.path.exists(os.path.join(main.UPLOAD_DIR, upload_id, "parts"))
+
+
+def test_oversized_chunk_is_rejected(main, uploads):
+    async def run():
+        upload_id, _ = await _init(main, 6)
+        errors = []
+        # the last part may only be 2 bytes; check both the declared length
+        # and a body streamed without one
+        for send_length in (True, False):
+            with pytest.raises(main.HTTPException) as exc:
+                await _put(main, upload_id, 1, b"toolong", send_length)
+            errors.append(exc.value.status_code)
+        part = os.path.join(main.UPLOAD_DIR, upload_id, "parts", "1")
+        return errors, os.path.exists(part)
+
+    assert asyncio.run(run()) == ([413, 413], False)
+
+
+def test_short_chunk_is_rejected(main, uploads):
+    async def run():
+        upload_id, _ = await _init(main, 6)
+        with pytest.raises(main.HTTPException) as exc:
+            await _put(main, upload_id, 0, b"abc")
+        assert exc.value.status_code == 400
+        assert (await main.upload_progress(upload_id, current_user={}))[
+            "missing"
+        ] == [0, 1]
+
+        await _put(main, upload_id, 0, b"abcd")
+        await _put(main, upload_id, 1, b"ef")
+        # A bad re-send of a part leaves the stored copy alone
+        with pytest.raises(main.HTTPException):
+            await _put(main, upload_id, 0, b"x")
+        await main.upload_complete(upload_id, current_user={})
+        return upload_id
+
+    upload_id = asyncio.run(run())
+    assert uploads == [(upload_id, b"abcdef", "chunked")]
+
+
+def test_size_mismatch_keeps_the_upload(main, uploads):
+    async def run():
+        upload_id, _ = await _init(main, 4)
+        await _put(main, upload_id, 0, b"abcd")
+        part = os.path.join(main.UPLOAD_DIR, upload_id, "parts", "0")
+        with open(part, "wb") as f:
+            f.write(b"ab")
+        with pytest.raises(main.HTTPException) as exc:
+            await main.upload_complete(upload_id, current_user={})
+        assert exc.value.status_code == 400
+        assert main.db_fetchone(
+            "SELECT claimed FROM uploads WHERE id=?", (upload_id,)
+        ) == (0,)
+
+        await _put(main, upload_id, 0, b"abcd")
+        await main.upload_complete(upload_id, current_user={})
+        return upload_id
+
+    upload_id = asyncio.run(run())
+    assert uploads == [(upload_id, b"abcd", "chunked")]
+
+
+def test_failed_join_keeps_the_upload(main, uploads, monkeypatch):
+    join_parts = main.join_parts
+
+    def broken_join(parts, dest):
+        raise OSError("disk full")
+
+    async def run():
+        upload_id, _ = await _init(main, 4)
+        await _put(main, upload_id, 0, b"abcd")
+        monkeypatch.setattr(main, "join_parts", broken_join)
+        with pytest.raises(main.HTTPException) as exc:
+            await main.upload_complete(upload_id, current_user={})
+        assert exc.value.status_code == 500
+        assert main.db_fetchone(
+            "SELECT claimed FROM uploads WHERE id=?", (upload_id,)
+        ) == (0,)
+
+        monkeypatch.setattr(main, "join_parts", join_parts)
+        await main.upload_complete(upload_id, current_user={})
+        return upload_id
+
+    upload_id = asyncio.run(run())
+    assert uploads == [(upload_id, b"abcd", "chunked")]
+
+
+def test_abandoned_uploads_expire(main, uploads, monkeypatch):
+    async def run():
+        stale, _ = await _init(main, 4)
+        monkeypatch.setattr(main, "UPLOAD_EXPIRY", -1)
+        expired = await main.expire_uploads()
+        monkeypatch.setattr(main, "UPLOAD_EXPIRY", 3600)
+        fresh, _ = await _init(main, 4)
+        return stale, fresh, expired, await main.expire_uploads()
+
+    stale, fresh, expired, expired_again = asyncio.run(run())
+    assert stale in expired and fresh not in expired_again
+    assert not os.path.exists(os.path.join(main.UPLOAD_DIR, stale))
+    assert os.path.isdir(os.path.join(main.UPLOAD_DIR, fresh, "parts"))
+    assert main.db_fetchone("SELECT id FROM uploads WHERE id=?", (stale,)) is None